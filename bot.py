@@ -1,13 +1,25 @@
-import json
 import os
+import sys
+import asyncio
+import functools
+import ctypes
+import ctypes.util
 import sqlite3
+import struct
 import logging
-from datetime import datetime
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from telegram import Update
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import pytz
+from main import RateArchive, open_storage
 
 # Load environment variables from .env file
 load_dotenv()
@@ -19,31 +31,148 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Local hour at which the daily rates are delivered
+DELIVERY_HOUR = 10
+
+
+# Longest the delivery job sleeps before checking for due users again
+DELIVERY_CHECK_INTERVAL = 3600
+# Failed deliveries are retried with exponential backoff and given up after MAX_DELIVERY_ATTEMPTS
+DELIVERY_RETRY_DELAY = 60
+MAX_DELIVERY_RETRY_DELAY = 3600
+MAX_DELIVERY_ATTEMPTS = 5
+# Delivered and abandoned outbox rows are kept this long to deduplicate deliveries
+OUTBOX_RETENTION_DAYS = 7
+# Claimed outbox rows are not due again for this long, so a send whose outcome could not be
+# recorded is retried later instead of immediately
+DELIVERY_LEASE = 600
+# BadRequest descriptions that mean the chat is gone for good
+UNREACHABLE_CHAT_ERRORS = ("chat not found", "user is deactivated", "peer_id_invalid")
+
+
+@functools.lru_cache(maxsize=None)
+def get_zone(timezone: str):
+    """Return the cached pytz zone for an IANA timezone name."""
+    return pytz.timezone(timezone)
+
+
+@functools.lru_cache(maxsize=4096)
+def delivery_instant(timezone: str, local_date):
+    """Return the Unix time of DELIVERY_HOUR:00 on a local date, following the zone's DST rules."""
+    zone = get_zone(timezone)
+    local = zone.localize(datetime(local_date.year, local_date.month, local_date.day, DELIVERY_HOUR))
+    return int(zone.normalize(local).timestamp())
+
+
+def next_delivery_utc(timezone: str, after: float = None):
+    """Return the Unix time of the next DELIVERY_HOUR:00 in a timezone."""
+    after = time.time() if after is None else after
+    local_date = datetime.fromtimestamp(after, get_zone(timezone)).date()
+    instant = delivery_instant(timezone, local_date)
+    if instant <= after:
+        instant = delivery_instant(timezone, local_date + timedelta(days=1))
+    return instant
+
+
+def is_unreachable(error: Exception):
+    """Return True if a send error means the chat will never accept messages again."""
+    if isinstance(error, Forbidden):
+        # Blocked by the user, kicked from the group, or the user was deleted
+        return True
+    if isinstance(error, BadRequest):
+        return any(reason in str(error).lower() for reason in UNREACHABLE_CHAT_ERRORS)
+    return False
+
+
+def is_retryable(error: Exception):
+    """Return True if a failed send is worth retrying; other bad requests fail every time."""
+    return not isinstance(error, BadRequest) and not is_unreachable(error)
+
 
 class DatabaseHandler:
     """Handles all database operations."""
 
-    def __init__(self, db_name: str = "users.db"):
+    SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+    DEFAULT_TIMEZONE = "Asia/Bangkok"
+    DEFAULT_CURRENCIES = "USD,RUB,EUR"
+
+    def __init__(self, db_name: str = "users.db", read_only: bool = False, synchronous: str = "NORMAL"):
         self.db_name = db_name
+        self.read_only = read_only
+        self.synchronous = synchronous.upper()
+        if self.synchronous not in self.SYNCHRONOUS_LEVELS:
+            raise ValueError(f"Invalid synchronous level: {synchronous}")
+        # Cleared by callers that group several writes into one transaction
+        self.autocommit = True
         self.conn = None
         self.cursor = None
         self.init_db()
 
+    def _commit(self):
+        if self.autocommit:
+            self.conn.commit()
+
     def init_db(self):
         """Initialize the SQLite database to store user chat IDs, timezones, and currencies."""
         try:
+            if self.read_only:
+                self.conn = sqlite3.connect(f"file:{self.db_name}?mode=ro", uri=True)
+                self.cursor = self.conn.cursor()
+                logger.info("Read-only database connection opened.")
+                return
+
             self.conn = sqlite3.connect(self.db_name)
             self.cursor = self.conn.cursor()
+            # WAL lets readers proceed while a write is in progress
+            self.cursor.execute("PRAGMA journal_mode = WAL")
+            self.cursor.execute(f"PRAGMA synchronous = {self.synchronous}")
 
             # Create the users table if it doesn't exist
-            self.cursor.execute("""
+            self.cursor.execute(f"""
                 CREATE TABLE IF NOT EXISTS users (
                     chat_id INTEGER PRIMARY KEY,
-                    timezone TEXT DEFAULT 'Asia/Bangkok',
-                    currencies TEXT DEFAULT 'USD,RUB,EUR',
-                    timezone_offset INTEGER
+                    timezone TEXT DEFAULT '{self.DEFAULT_TIMEZONE}',
+                    currencies TEXT DEFAULT '{self.DEFAULT_CURRENCIES}',
+                    timezone_offset INTEGER,
+                    next_delivery_utc INTEGER,
+                    inactive_since INTEGER,
+                    failures INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self.migrate()
+            self.cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_users_next_delivery ON users (next_delivery_utc)"
+            )
+            self.cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_users_inactive ON users (inactive_since) WHERE inactive_since IS NOT NULL"
+            )
+
+            # Outbox of daily deliveries; each rendered message is stored once in payloads.
+            # A row is pending while sent_at and next_attempt are set, delivered once sent_at
+            # is set, and abandoned when both are NULL.
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS payloads (
+                    id INTEGER PRIMARY KEY,
+                    body TEXT NOT NULL,
+                    created INTEGER NOT NULL
+                )
+            """)
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    chat_id INTEGER NOT NULL,
+                    delivery_date TEXT NOT NULL,
+                    payload_id INTEGER NOT NULL REFERENCES payloads (id),
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt INTEGER,
+                    sent_at INTEGER,
+                    PRIMARY KEY (chat_id, delivery_date)
                 )
             """)
+            self.cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (next_attempt) WHERE sent_at IS NULL"
+            )
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_delivery_date ON outbox (delivery_date)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_payload ON outbox (payload_id)")
             self.conn.commit()
             logger.info("Database initialized successfully.")
         except Exception as e:
@@ -51,21 +180,59 @@ class DatabaseHandler:
             raise
 
 
+    def migrate(self):
+        """Add the delivery columns to older databases and schedule their users."""
+        columns = [row[1] for row in self.cursor.execute("PRAGMA table_info(users)")]
+        for column, definition in (
+            ("next_delivery_utc", "INTEGER"),
+            ("inactive_since", "INTEGER"),
+            ("failures", "INTEGER NOT NULL DEFAULT 0"),
+        ):
+            if column not in columns:
+                self.cursor.execute(f"ALTER TABLE users ADD COLUMN {column} {definition}")
+                logger.info(f"Added {column} column to the users table.")
+
+        # Inactive users have no next delivery on purpose
+        pending = self.cursor.execute(
+            "SELECT chat_id, timezone FROM users WHERE next_delivery_utc IS NULL AND inactive_since IS NULL"
+        ).fetchall()
+        self.cursor.executemany(
+            "UPDATE users SET next_delivery_utc = ? WHERE chat_id = ?",
+            [(next_delivery_utc(timezone), chat_id) for chat_id, timezone in pending],
+        )
+        if pending:
+            logger.info(f"Scheduled the next delivery for {len(pending)} existing users.")
+
     def add_user(self, chat_id: int):
         """Add a user to the database if they don't already exist."""
         try:
-            self.cursor.execute("INSERT OR IGNORE INTO users (chat_id) VALUES (?)", (chat_id,))
-            self.conn.commit()
+            self.cursor.execute(
+                "INSERT OR IGNORE INTO users (chat_id, next_delivery_utc) VALUES (?, ?)",
+                (chat_id, next_delivery_utc(self.DEFAULT_TIMEZONE)),
+            )
+            if not self.cursor.rowcount:
+                # A returning user who was marked inactive can be reached again
+                timezone, = self.cursor.execute("SELECT timezone FROM users WHERE chat_id = ?", (chat_id,)).fetchone()
+                self.cursor.execute(
+                    "UPDATE users SET inactive_since = NULL, failures = 0, next_delivery_utc = ? "
+                    "WHERE chat_id = ? AND (inactive_since IS NOT NULL OR failures > 0)",
+                    (next_delivery_utc(timezone), chat_id),
+                )
+            self._commit()
             logger.info(f"User {chat_id} added to the database.")
         except Exception as e:
             logger.exception(f"Failed to add user {chat_id} to the database.")
             raise
 
-    def update_timezone(self, chat_id: int, timezone: str):
-        """Update the user's timezone."""
+    def update_timezone(self, chat_id: int, timezone: str, timezone_offset: int = None):
+        """Update the user's timezone and its UTC offset in hours."""
         try:
-            self.cursor.execute("UPDATE users SET timezone = ? WHERE chat_id = ?", (timezone, chat_id))
-            self.conn.commit()
+            self.cursor.execute(
+                "UPDATE users SET timezone = ?, timezone_offset = ?, next_delivery_utc = ?, inactive_since = NULL, "
+                "failures = 0 WHERE chat_id = ?",
+                (timezone, timezone_offset, next_delivery_utc(timezone), chat_id),
+            )
+            self._commit()
             logger.info(f"User {chat_id} updated timezone to {timezone}.")
         except Exception as e:
             logger.exception(f"Failed to update timezone for user {chat_id}.")
@@ -75,7 +242,7 @@ class DatabaseHandler:
         """Update the user's preferred currencies."""
         try:
             self.cursor.execute("UPDATE users SET currencies = ? WHERE chat_id = ?", (currencies, chat_id))
-            self.conn.commit()
+            self._commit()
             logger.info(f"User {chat_id} updated currencies to {currencies}.")
         except Exception as e:
             logger.exception(f"Failed to update currencies for user {chat_id}.")
@@ -85,7 +252,8 @@ class DatabaseHandler:
         """Delete a user from the database."""
         try:
             self.cursor.execute("DELETE FROM users WHERE chat_id = ?", (chat_id,))
-            self.conn.commit()
+            self.cursor.execute("DELETE FROM outbox WHERE chat_id = ? AND sent_at IS NULL", (chat_id,))
+            self._commit()
             logger.info(f"User {chat_id} deleted from the database.")
         except Exception as e:
             logger.exception(f"Failed to delete user {chat_id}.")
@@ -109,6 +277,185 @@ class DatabaseHandler:
             logger.exception("Failed to fetch all users.")
             raise
 
+    def get_due_users(self, now: int):
+        """Get the users whose next delivery is due at the given Unix time."""
+        try:
+            self.cursor.execute(
+                "SELECT chat_id, timezone, currencies, next_delivery_utc FROM users "
+                "WHERE next_delivery_utc <= ? ORDER BY next_delivery_utc",
+                (now,),
+            )
+            return self.cursor.fetchall()
+        except Exception as e:
+            logger.exception("Failed to fetch due users.")
+            raise
+
+    def get_next_delivery(self):
+        """Get the earliest due user or pending outbox retry, or None if there is nothing to send."""
+        try:
+            self.cursor.execute("""
+                SELECT MIN(due) FROM (
+                    SELECT MIN(next_delivery_utc) AS due FROM users
+                    UNION ALL
+                    SELECT MIN(next_attempt) FROM outbox WHERE sent_at IS NULL
+                )
+            """)
+            return self.cursor.fetchone()[0]
+        except Exception as e:
+            logger.exception("Failed to fetch the next delivery time.")
+            raise
+
+    def enqueue_deliveries(self, payloads, deliveries, now: int):
+        """Queue deliveries in the outbox and move the users on to their next delivery.
+
+        ``payloads`` is a list of rendered messages and ``deliveries`` a list of
+        (chat_id, timezone, next_delivery_utc, payload index) for the due users. Both steps
+        happen in one transaction, so a crash either queues a user or leaves them due.
+        """
+        try:
+            payload_ids = []
+            for body in payloads:
+                self.cursor.execute("INSERT INTO payloads (body, created) VALUES (?, ?)", (body, now))
+                payload_ids.append(self.cursor.lastrowid)
+
+            # A delivery is identified by the user's local date, so re-queueing one is a no-op
+            self.cursor.executemany(
+                "INSERT OR IGNORE INTO outbox (chat_id, delivery_date, payload_id, next_attempt) VALUES (?, ?, ?, ?)",
+                [
+                    (chat_id, datetime.fromtimestamp(due, get_zone(timezone)).date().isoformat(), payload_ids[index], now)
+                    for chat_id, timezone, due, index in deliveries
+                ],
+            )
+            # Leave users alone whose timezone changed since they were read
+            self.cursor.executemany(
+                "UPDATE users SET next_delivery_utc = ? WHERE chat_id = ? AND next_delivery_utc = ?",
+                [(next_delivery_utc(timezone, now), chat_id, due) for chat_id, timezone, due, _ in deliveries],
+            )
+            self._commit()
+            logger.info(f"Queued {len(deliveries)} deliveries with {len(payloads)} distinct messages.")
+        except Exception as e:
+            logger.exception("Failed to queue deliveries.")
+            raise
+
+    def claim_deliveries(self, now: int, limit: int, lease_until: int):
+        """Claim up to ``limit`` due outbox rows, grouped by payload, by moving their next attempt to ``lease_until``."""
+        try:
+            self.cursor.execute(
+                "SELECT chat_id, payload_id, delivery_date, attempts FROM outbox "
+                "WHERE sent_at IS NULL AND next_attempt <= ? "
+                "ORDER BY next_attempt, payload_id LIMIT ?",
+                (now, limit),
+            )
+            rows = self.cursor.fetchall()
+            self.cursor.executemany(
+                "UPDATE outbox SET next_attempt = ? WHERE chat_id = ? AND delivery_date = ?",
+                [(lease_until, chat_id, delivery_date) for chat_id, _, delivery_date, _ in rows],
+            )
+            self._commit()
+            return rows
+        except Exception as e:
+            logger.exception("Failed to claim pending deliveries.")
+            raise
+
+    def get_payloads(self, payload_ids):
+        """Get the bodies of the given payloads, keyed by id."""
+        try:
+            payload_ids = list(payload_ids)
+            placeholders = ",".join("?" * len(payload_ids))
+            self.cursor.execute(f"SELECT id, body FROM payloads WHERE id IN ({placeholders})", payload_ids)
+            return dict(self.cursor.fetchall())
+        except Exception as e:
+            logger.exception("Failed to fetch payloads.")
+            raise
+
+    def mark_delivered(self, chat_id: int, delivery_date: str, sent_at: int):
+        """Mark an outbox row as delivered."""
+        try:
+            self.cursor.execute(
+                "UPDATE outbox SET sent_at = ?, next_attempt = NULL, attempts = attempts + 1 "
+                "WHERE chat_id = ? AND delivery_date = ?",
+                (sent_at, chat_id, delivery_date),
+            )
+            # The chat is reachable again, so earlier unreachable deliveries no longer count
+            self.cursor.execute("UPDATE users SET failures = 0 WHERE chat_id = ? AND failures > 0", (chat_id,))
+            self._commit()
+        except Exception as e:
+            logger.exception(f"Failed to mark the delivery to user {chat_id} as sent.")
+            raise
+
+    def mark_failed(self, chat_id: int, delivery_date: str, next_attempt: int = None):
+        """Record a failed attempt; without a next attempt the delivery is abandoned."""
+        try:
+            self.cursor.execute(
+                "UPDATE outbox SET attempts = attempts + 1, next_attempt = ? "
+                "WHERE chat_id = ? AND delivery_date = ?",
+                (next_attempt, chat_id, delivery_date),
+            )
+            self._commit()
+        except Exception as e:
+            logger.exception(f"Failed to record the failed delivery to user {chat_id}.")
+            raise
+
+    def count_unreachable(self, chat_id: int):
+        """Count another delivery to an unreachable user and return how many there have been in a row."""
+        try:
+            self.cursor.execute("UPDATE users SET failures = failures + 1 WHERE chat_id = ?", (chat_id,))
+            row = self.cursor.execute("SELECT failures FROM users WHERE chat_id = ?", (chat_id,)).fetchone()
+            self._commit()
+            return row[0] if row else 0
+        except Exception as e:
+            logger.exception(f"Failed to count the failed delivery to user {chat_id}.")
+            raise
+
+    def deactivate_user(self, chat_id: int, now: int):
+        """Stop deliveries to an unreachable user and drop their pending deliveries."""
+        try:
+            self.cursor.execute(
+                "UPDATE users SET inactive_since = ?, next_delivery_utc = NULL "
+                "WHERE chat_id = ? AND inactive_since IS NULL",
+                (now, chat_id),
+            )
+            self.cursor.execute(
+                "UPDATE outbox SET next_attempt = NULL WHERE chat_id = ? AND sent_at IS NULL", (chat_id,)
+            )
+            self._commit()
+            logger.info(f"User {chat_id} marked inactive.")
+        except Exception as e:
+            logger.exception(f"Failed to mark user {chat_id} inactive.")
+            raise
+
+    def delete_inactive_users(self, before: int):
+        """Delete users who have been inactive since before the given Unix time and return their chat IDs."""
+        try:
+            self.cursor.execute("SELECT chat_id FROM users WHERE inactive_since < ?", (before,))
+            chat_ids = [chat_id for chat_id, in self.cursor.fetchall()]
+            self.cursor.execute("DELETE FROM users WHERE inactive_since < ?", (before,))
+            self._commit()
+            if chat_ids:
+                logger.info(f"Deleted {len(chat_ids)} inactive users.")
+            return chat_ids
+        except Exception as e:
+            logger.exception("Failed to delete inactive users.")
+            raise
+
+    def prune_outbox(self, before_date: str):
+        """Delete finished outbox rows older than a date, then payloads nothing refers to."""
+        try:
+            self.cursor.execute(
+                "DELETE FROM outbox WHERE delivery_date < ? AND (sent_at IS NOT NULL OR next_attempt IS NULL)",
+                (before_date,),
+            )
+            pruned = self.cursor.rowcount
+            self.cursor.execute(
+                "DELETE FROM payloads WHERE NOT EXISTS (SELECT 1 FROM outbox WHERE outbox.payload_id = payloads.id)"
+            )
+            self._commit()
+            if pruned:
+                logger.info(f"Pruned {pruned} finished deliveries from the outbox.")
+        except Exception as e:
+            logger.exception("Failed to prune the outbox.")
+            raise
+
 
     def close(self):
         """Close the database connection."""
@@ -117,6 +464,483 @@ class DatabaseHandler:
             logger.info("Database connection closed.")
 
 
+def normalize_currencies(currencies: str):
+    """Normalize a comma-separated currency list to an upper-case tuple without duplicates."""
+    return tuple(dict.fromkeys(code.strip().upper() for code in currencies.split(",") if code.strip()))
+
+
+class RatesIndex:
+    """One loaded version of the exchange rates with its dates sorted and selected up front.
+
+    Built once per reload so handlers do constant-time lookups instead of sorting and
+    parsing every date on each request. Treat it as immutable.
+    """
+
+    __slots__ = ("data", "dates", "latest_date", "previous_date", "history_dates")
+
+    def __init__(self, data):
+        self.data = data
+        self.dates = tuple(sorted(data, reverse=True))
+        self.latest_date = self.dates[0] if self.dates else None
+        self.previous_date = self.dates[1] if len(self.dates) > 1 else None
+        self.history_dates = self.select_history_dates(self.dates)
+
+    @staticmethod
+    def select_history_dates(sorted_dates, count=10, spacing_days=2):
+        """Select the last records spaced every two days from dates sorted newest first."""
+        if not sorted_dates:
+            return ()
+        selected_dates = []
+        current_date = datetime.strptime(sorted_dates[0], "%Y-%m-%d")
+
+        for date in sorted_dates:
+            date_obj = datetime.strptime(date, "%Y-%m-%d")
+            if (current_date - date_obj).days % spacing_days == 0:
+                selected_dates.append(date)
+                if len(selected_dates) >= count:
+                    break
+        return tuple(selected_dates)
+
+
+class UserProfile:
+    """Cached copy of one user's row."""
+
+    __slots__ = ("timezone", "currencies")
+
+    def __init__(self, timezone: str, currencies: str):
+        self.timezone = timezone
+        self.currencies = currencies
+
+
+class AsyncDatabaseHandler:
+    """Async front end for DatabaseHandler with separate write and read paths.
+
+    Writes are queued to one writer thread that group-commits everything arriving within
+    ``commit_window`` seconds in a single transaction, so a burst of sign-ups costs one fsync
+    instead of one per statement. Each write runs in its own savepoint, so one failing write
+    does not roll back the rest of the group. Reads use a separate read-only connection on
+    their own thread and, thanks to WAL, never wait for the writer. Each connection is only
+    ever used from the thread that owns it.
+
+    User profiles are also cached in memory: the cache is warmed at startup and updated
+    after each committed write, so user lookups never touch the database. When other
+    processes write to the same database the cache would go stale, so ``cache_users=False``
+    reads every lookup through the read-only connection instead.
+    """
+
+    def __init__(self, db_name: str = "users.db", synchronous: str = "NORMAL",
+                 commit_window: float = 0.005, max_batch: int = 500, cache_users: bool = True):
+        self.commit_window = commit_window
+        self.max_batch = max_batch
+        self._closed = False
+        self._writes = queue.Queue()
+        ready = Future()
+        self._writer = threading.Thread(
+            target=self._write_loop, args=(db_name, synchronous, ready), name="database-writer", daemon=True
+        )
+        self._writer.start()
+        # The writer creates the schema, so wait for it before opening the read-only connection
+        ready.result()
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database-reader")
+        self.reader_db = self._reader.submit(DatabaseHandler, db_name, True).result()
+
+        # Warm the user profile cache; from here on it is only changed by the write methods below
+        self.users = None
+        if cache_users:
+            self.users = {
+                chat_id: UserProfile(timezone, currencies)
+                for chat_id, timezone, currencies, _ in self._reader.submit(self.reader_db.get_all_users).result()
+            }
+            logger.info(f"Cached {len(self.users)} user profiles.")
+
+    def _write_loop(self, db_name, synchronous, ready):
+        try:
+            db = DatabaseHandler(db_name, synchronous=synchronous)
+            # Transactions are managed per batch below
+            db.conn.isolation_level = None
+            db.autocommit = False
+        except Exception as e:
+            ready.set_exception(e)
+            return
+        ready.set_result(None)
+
+        stopping = False
+        while not stopping:
+            item = self._writes.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.commit_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._writes.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit_batch(db, batch)
+        db.close()
+
+    def _commit_batch(self, db, batch):
+        """Run a batch of writes in one transaction and resolve their futures once it is committed."""
+        results = []
+        try:
+            db.conn.execute("BEGIN")
+            for method, args, future in batch:
+                db.conn.execute("SAVEPOINT write")
+                try:
+                    results.append((future, method(db, *args), None))
+                    db.conn.execute("RELEASE write")
+                except Exception as e:
+                    db.conn.execute("ROLLBACK TO write")
+                    db.conn.execute("RELEASE write")
+                    results.append((future, None, e))
+            db.conn.execute("COMMIT")
+        except Exception as e:
+            logger.exception(f"Failed to commit a batch of {len(batch)} writes.")
+            if db.conn.in_transaction:
+                db.conn.execute("ROLLBACK")
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        if len(batch) > 1:
+            logger.debug(f"Group-committed {len(batch)} writes.")
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    async def _write(self, method, *args):
+        future = Future()
+        self._writes.put((method, args, future))
+        return await asyncio.wrap_future(future)
+
+    async def _read(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._reader, method, self.reader_db, *args)
+
+    async def add_user(self, chat_id: int):
+        """Add a user to the database if they don't already exist."""
+        await self._write(DatabaseHandler.add_user, chat_id)
+        if self.users is not None and chat_id not in self.users:
+            self.users[chat_id] = UserProfile(DatabaseHandler.DEFAULT_TIMEZONE, DatabaseHandler.DEFAULT_CURRENCIES)
+
+    async def update_timezone(self, chat_id: int, timezone: str, timezone_offset: int = None):
+        """Update the user's timezone and its UTC offset in hours."""
+        await self._write(DatabaseHandler.update_timezone, chat_id, timezone, timezone_offset)
+        profile = self.users.get(chat_id) if self.users is not None else None
+        if profile:
+            profile.timezone = timezone
+
+    async def update_currencies(self, chat_id: int, currencies: str):
+        """Update the user's preferred currencies."""
+        await self._write(DatabaseHandler.update_currencies, chat_id, currencies)
+        profile = self.users.get(chat_id) if self.users is not None else None
+        if profile:
+            profile.currencies = currencies
+
+    async def delete_user(self, chat_id: int):
+        """Delete a user from the database."""
+        await self._write(DatabaseHandler.delete_user, chat_id)
+        if self.users is not None:
+            self.users.pop(chat_id, None)
+
+    async def get_user(self, chat_id: int):
+        """Get a user's timezone and currencies from the cache, or the database if caching is off."""
+        if self.users is None:
+            return await self._read(DatabaseHandler.get_user, chat_id)
+        profile = self.users.get(chat_id)
+        return (profile.timezone, profile.currencies) if profile else None
+
+    async def get_due_users(self, now: int):
+        """Get the users whose next delivery is due, using the next_delivery_utc index."""
+        return await self._read(DatabaseHandler.get_due_users, now)
+
+    async def get_next_delivery(self):
+        """Get the earliest due user or pending outbox retry."""
+        return await self._read(DatabaseHandler.get_next_delivery)
+
+    async def enqueue_deliveries(self, payloads, deliveries, now: int):
+        """Queue deliveries in the outbox and move the users on to their next delivery."""
+        return await self._write(DatabaseHandler.enqueue_deliveries, payloads, deliveries, now)
+
+    async def claim_deliveries(self, now: int, limit: int, lease_until: int):
+        """Claim outbox rows whose next attempt is due until ``lease_until``."""
+        return await self._write(DatabaseHandler.claim_deliveries, now, limit, lease_until)
+
+    async def get_payloads(self, payload_ids):
+        """Get the bodies of the given payloads, keyed by id."""
+        return await self._read(DatabaseHandler.get_payloads, payload_ids)
+
+    async def mark_delivered(self, chat_id: int, delivery_date: str, sent_at: int):
+        """Mark an outbox row as delivered."""
+        return await self._write(DatabaseHandler.mark_delivered, chat_id, delivery_date, sent_at)
+
+    async def mark_failed(self, chat_id: int, delivery_date: str, next_attempt: int = None):
+        """Record a failed delivery attempt."""
+        return await self._write(DatabaseHandler.mark_failed, chat_id, delivery_date, next_attempt)
+
+    async def prune_outbox(self, before_date: str):
+        """Delete finished outbox rows older than a date."""
+        return await self._write(DatabaseHandler.prune_outbox, before_date)
+
+    async def count_unreachable(self, chat_id: int):
+        """Count another delivery to an unreachable user."""
+        return await self._write(DatabaseHandler.count_unreachable, chat_id)
+
+    async def deactivate_user(self, chat_id: int, now: int):
+        """Stop deliveries to an unreachable user."""
+        return await self._write(DatabaseHandler.deactivate_user, chat_id, now)
+
+    async def delete_inactive_users(self, before: int):
+        """Delete users inactive since before the given Unix time and drop them from the cache."""
+        chat_ids = await self._write(DatabaseHandler.delete_inactive_users, before)
+        if self.users is not None:
+            for chat_id in chat_ids:
+                self.users.pop(chat_id, None)
+        return chat_ids
+
+    def close(self):
+        """Flush pending writes, then close both connections and stop their threads. Safe to call twice."""
+        if self._closed:
+            return
+        self._closed = True
+        self._writes.put(None)
+        self._writer.join()
+        self._reader.submit(self.reader_db.close).result()
+        self._reader.shutdown()
+
+
+class ExchangeRatesWatcher:
+    """Calls a coroutine whenever the exchange rates file changes.
+
+    On Linux this uses inotify on the file's directory, so atomic replaces, appends and
+    SQLite WAL writes are all seen. Elsewhere, or if inotify is unavailable, it polls the
+    file's mtime, size and inode.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+    def __init__(self, file_path, callback, debounce: float = 1.0, poll_interval: float = 5.0):
+        self.file_path = os.path.abspath(file_path)
+        name = os.path.basename(self.file_path)
+        self.names = {name, f"{name}-wal"}
+        self.callback = callback
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.loop = None
+        self._fd = None
+        self._pending = None
+        self._signature = None
+        self._tasks = set()
+
+    def start(self, application: Application):
+        """Start watching, using inotify if possible and polling through the job queue otherwise."""
+        self.loop = asyncio.get_running_loop()
+        if self._start_inotify():
+            logger.info(f"Watching {self.file_path} with inotify.")
+            return
+        self._signature = self._stat_signature()
+        application.job_queue.run_repeating(self._poll, interval=self.poll_interval, first=self.poll_interval)
+        logger.info(f"Polling {self.file_path} for changes every {self.poll_interval} seconds.")
+
+    def _start_inotify(self):
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+            if libc.inotify_add_watch(fd, os.path.dirname(self.file_path).encode(), mask) < 0:
+                error = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(error, "inotify_add_watch failed")
+        except (OSError, AttributeError):
+            logger.warning("inotify is not available. Falling back to polling.", exc_info=True)
+            return False
+        self._fd = fd
+        self.loop.add_reader(fd, self._read_events)
+        return True
+
+    def _read_events(self):
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        changed = False
+        while offset < len(buffer):
+            _, _, _, length = self.EVENT_HEADER.unpack_from(buffer, offset)
+            offset += self.EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            changed = changed or name in self.names
+        if changed:
+            # Coalesce the burst of events a single write produces into one reload
+            if self._pending:
+                self._pending.cancel()
+            self._pending = self.loop.call_later(self.debounce, self._fire)
+
+    def _fire(self):
+        self._pending = None
+        task = self.loop.create_task(self.callback())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _stat_signature(self):
+        signature = []
+        for name in sorted(self.names):
+            try:
+                stat = os.stat(os.path.join(os.path.dirname(self.file_path), name))
+                signature.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    async def _poll(self, context: ContextTypes.DEFAULT_TYPE):
+        signature = self._stat_signature()
+        if signature != self._signature:
+            self._signature = signature
+            await self.callback()
+
+    def stop(self):
+        """Stop watching."""
+        if self._pending:
+            self._pending.cancel()
+            self._pending = None
+        if self._fd is not None:
+            self.loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+
+class RateLimitedSender:
+    """Sends messages concurrently while staying inside Telegram's rate limits.
+
+    A global token bucket allows ``rate`` messages per second with bursts of at most ``burst``,
+    each chat gets at most one message per ``per_chat_interval`` seconds, and a RetryAfter (429)
+    pauses every sender for the requested time before the message is retried.
+    """
+
+    def __init__(self, bot, concurrency: int = 16, rate: float = 30.0,
+                 per_chat_interval: float = 1.0, max_retries: int = 3, burst: float = 1.0):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.rate = rate
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.burst = burst
+        # Start empty so the first second sends at most ``rate`` messages, not a full bucket on top
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._bucket_lock = asyncio.Lock()
+        self._last_sent = {}
+
+    @staticmethod
+    def retry_after_seconds(error: RetryAfter):
+        """Return the wait requested by a RetryAfter, which is a timedelta in newer releases."""
+        retry_after = error.retry_after
+        return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+    async def _acquire(self):
+        """Wait for a token from the global bucket."""
+        async with self._bucket_lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def _pace(self, chat_id: int):
+        """Wait until the chat may receive another message."""
+        last = self._last_sent.get(chat_id)
+        if last is not None:
+            wait = last + self.per_chat_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    async def send(self, chat_id: int, text: str, **kwargs):
+        """Send one message, waiting out flood control up to max_retries times."""
+        for attempt in range(self.max_retries + 1):
+            await self._pace(chat_id)
+            await self._acquire()
+            self._last_sent[chat_id] = time.monotonic()
+            try:
+                return await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_after_seconds(e)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                # No credit builds up during the pause, so sending resumes at ``rate`` instead of bursting
+                self._tokens = 0.0
+                self._updated = self._paused_until
+                logger.warning(f"Flood control exceeded, pausing sends for {delay:.0f} seconds.")
+
+    async def send_many(self, messages, on_result=None, **kwargs):
+        """Send messages with bounded concurrency and return the run's statistics.
+
+        Each message is a tuple starting with (chat_id, text); any further items are passed
+        through to ``on_result(message, error)``, which is awaited after each send with error
+        set to None on success.
+        """
+        stats = {"sent": 0, "failed": 0}
+        started = time.monotonic()
+        messages = iter(messages)
+
+        async def worker():
+            # Workers share the iterator, so at most `concurrency` messages are in flight
+            for message in messages:
+                chat_id, text = message[:2]
+                error = None
+                try:
+                    await self.send(chat_id, text, **kwargs)
+                    stats["sent"] += 1
+                except TelegramError as e:
+                    # Expected API errors, e.g. a blocked bot; the caller decides what to do
+                    logger.warning(f"Failed to send a message to chat {chat_id}: {e}")
+                    stats["failed"] += 1
+                    error = e
+                except Exception as e:
+                    logger.exception(f"Failed to send a message to chat {chat_id}.")
+                    stats["failed"] += 1
+                    error = e
+                if on_result:
+                    await on_result(message, error)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+        elapsed = time.monotonic() - started
+        stats["elapsed"] = elapsed
+        stats["per_second"] = stats["sent"] / elapsed if elapsed > 0 else 0.0
+        logger.info(
+            f"Sent {stats['sent']} messages in {elapsed:.1f} seconds "
+            f"({stats['per_second']:.1f} msg/s), {stats['failed']} failed."
+        )
+
+        # Forget chats whose pacing window has passed
+        cutoff = time.monotonic() - self.per_chat_interval
+        self._last_sent = {chat_id: sent for chat_id, sent in self._last_sent.items() if sent > cutoff}
+        return stats
+
+
 class ExchangeRateBot:
     def __init__(self):
         # Get the bot token from the environment variable
@@ -126,10 +950,24 @@ class ExchangeRateBot:
             raise ValueError("Please set the TELEGRAM_BOT_TOKEN environment variable in the .env file.")
 
         # Initialize the bot application
-        self.application = Application.builder().token(self.bot_token).post_init(self.post_init).build()
+        self.application = (
+            Application.builder()
+            .token(self.bot_token)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
+
+        # Several bot processes on one host may share users.db (e.g. webhook instances behind a
+        # load balancer). Each then reads users from the database instead of its own cache.
+        shared_database = os.getenv("USERS_DB_SHARED", "0") != "0"
 
         # Initialize the database handler
-        self.db_handler = DatabaseHandler()
+        self.db_handler = AsyncDatabaseHandler(
+            synchronous=os.getenv("USERS_DB_SYNCHRONOUS", "NORMAL"),
+            commit_window=float(os.getenv("USERS_DB_COMMIT_WINDOW_MS", "5")) / 1000,
+            cache_users=not shared_database,
+        )
 
         # Add command handlers
         self.application.add_handler(CommandHandler("start", self.start))
@@ -147,9 +985,52 @@ class ExchangeRateBot:
 
         # Initialize the scheduler
         self.scheduler = AsyncIOScheduler()
+        # Keeps delivery runs apart when a reschedule fires while one is still sending
+        self._delivery_lock = asyncio.Lock()
+        # Rate-limited fan-out for the daily rates
+        self.sender = RateLimitedSender(
+            self.application.bot,
+            concurrency=int(os.getenv("DAILY_RATES_CONCURRENCY", "16")),
+            rate=float(os.getenv("DAILY_RATES_PER_SECOND", "30")),
+        )
+        self.outbox_batch_size = int(os.getenv("DAILY_RATES_BATCH_SIZE", "500"))
+        # Unreachable users are deleted after this many unreachable deliveries in a row if it is set,
+        # and otherwise marked inactive on the first one
+        grace_count = os.getenv("INACTIVE_USER_GRACE_COUNT")
+        self.inactive_grace_count = int(grace_count) if grace_count else None
+        # Inactive users are deleted after this many days if it is set
+        grace_days = os.getenv("INACTIVE_USER_GRACE_DAYS")
+        self.inactive_grace_days = float(grace_days) if grace_days else None
+        # With several instances sharing users.db, only one of them should send the daily rates.
+        # It cannot see the others' /start and /settimezone, so it checks for due users more often.
+        self.deliveries_enabled = os.getenv("DAILY_RATES_ENABLED", "1") != "0"
+        self.delivery_check_interval = (
+            float(os.getenv("DAILY_RATES_POLL_INTERVAL", "60")) if shared_database else DELIVERY_CHECK_INTERVAL
+        )
+
+        # Open the exchange rate storage written by main.py
+        self.rate_storage = open_storage(
+            os.getenv("EXCHANGE_RATES_STORAGE", "json"),
+            os.getenv("EXCHANGE_RATES_FILE"),
+        )
+        archive_dir = os.getenv("EXCHANGE_RATES_ARCHIVE")
+        self.rate_archive = RateArchive(archive_dir) if archive_dir else None
 
         # Load exchange rates initially
-        self.exchange_rates = self.load_exchange_rates()
+        self.rates_index = self.load_exchange_rates()
+
+        # Rendered rate messages, keyed by data version and normalized currency list
+        self.rates_version = 0
+        self._cached_rates_message = functools.lru_cache(maxsize=1024)(self._render_rates_message)
+        # Serializes reloads so only one worker thread parses at a time
+        self._reload_lock = asyncio.Lock()
+
+        # Reload the exchange rates as soon as the scraper writes new ones
+        self.rates_watcher = ExchangeRatesWatcher(
+            self.rate_storage.file_path,
+            self.reload_exchange_rates,
+            poll_interval=float(os.getenv("EXCHANGE_RATES_POLL_INTERVAL", "5")),
+        )
 
     async def post_init(self, application: Application):
         """Set up bot commands using set_my_commands."""
@@ -164,13 +1045,26 @@ class ExchangeRateBot:
         ])
         logger.info("Bot commands have been set up.")
 
+        self.rates_watcher.start(application)
+        await self.schedule_delivery_job()
+
+    async def post_shutdown(self, application: Application):
+        """Stop watching the exchange rates file and clean up resources while the executors still run."""
+        self.rates_watcher.stop()
+        self.db_handler.close()
+        self.rate_storage.close()
+        if self.rate_archive:
+            self.rate_archive.close()
+        logger.info("Bot shut down and resources cleaned up.")
+
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handler for the /start command."""
         chat_id = update.message.chat_id
 
         # Save the user's chat ID to the database if not already present
         try:
-            self.db_handler.add_user(chat_id)
+            await self.db_handler.add_user(chat_id)
+            await self.schedule_delivery_job()
             logger.info(f"User {chat_id} started the bot.")
         except Exception as e:
             logger.exception(f"Failed to save user {chat_id} to the database.")
@@ -194,22 +1088,18 @@ class ExchangeRateBot:
 
         if timezone and timezone in pytz.all_timezones:
             try:
-                # Calculate the offset in hours (rounded to the nearest integer)
-                tz = pytz.timezone(timezone)
-                now = datetime.now(tz)
-                offset = now.utcoffset().total_seconds() / 3600  # Convert to hours
-                offset_int = int(round(offset))  # Round to the nearest integer
-
-                # Update the database with the timezone and offset
-                self.db_handler.update_timezone(chat_id, timezone)
-                self.db_handler.cursor.execute(
-                    "UPDATE users SET timezone_offset = ? WHERE chat_id = ?",
-                    (offset_int, chat_id)
-                )
-                self.db_handler.conn.commit()
-
-                await update.message.reply_text(f"Your timezone has been set to {timezone} (offset: UTC{offset_int:+d}).")
-                logger.info(f"User {chat_id} set timezone to {timezone} (offset: UTC{offset_int:+d}).")
+                # The current offset is only informational; deliveries follow the zone's DST rules
+                now = datetime.now(get_zone(timezone))
+                offset = now.strftime("%z")
+                offset_label = f"UTC{offset[:3]}:{offset[3:]}"
+                offset_int = int(round(now.utcoffset().total_seconds() / 3600))
+
+                # Update the database with the timezone, which also reschedules the next delivery
+                await self.db_handler.update_timezone(chat_id, timezone, offset_int)
+                await self.schedule_delivery_job()
+
+                await update.message.reply_text(f"Your timezone has been set to {timezone} (currently {offset_label}).")
+                logger.info(f"User {chat_id} set timezone to {timezone} (currently {offset_label}).")
             except Exception as e:
                 logger.exception(f"Failed to update timezone for user {chat_id}.")
                 await update.message.reply_text("An error occurred. Please try again later.")
@@ -224,7 +1114,7 @@ class ExchangeRateBot:
 
         if currencies:
             try:
-                self.db_handler.update_currencies(chat_id, currencies)
+                await self.db_handler.update_currencies(chat_id, currencies)
                 await update.message.reply_text(f"Your preferred currencies have been set to {currencies}.")
                 logger.info(f"User {chat_id} set currencies to {currencies}.")
             except Exception as e:
@@ -238,7 +1128,7 @@ class ExchangeRateBot:
         chat_id = update.message.chat_id
 
         try:
-            self.db_handler.delete_user(chat_id)
+            await self.db_handler.delete_user(chat_id)
             await update.message.reply_text("You have been unsubscribed from daily updates.")
             logger.info(f"User {chat_id} unsubscribed and removed from the database.")
         except Exception as e:
@@ -251,41 +1141,61 @@ class ExchangeRateBot:
         await update.message.reply_text(f"Available timezones:\n\n{timezones}")
 
     def load_exchange_rates(self):
-        """Load the exchange rates from the JSON file."""
+        """Load the exchange rates from the storage and index them."""
+        if self.rate_storage.supports_queries:
+            logger.info("Exchange rates are queried from the storage on demand.")
+            return None
         try:
-            with open("exchange_rates.json", "r") as file:
-                data = json.load(file)
+            data = self.rate_storage.load_data()
+            # The storage returns the same object while its file is unchanged
+            current = getattr(self, "rates_index", None)
+            if current is not None and current.data is data:
+                logger.info("Exchange rates unchanged.")
+                return current
+            index = RatesIndex(data)
             logger.info("Exchange rates loaded successfully.")
-            return data
+            return index
         except Exception as e:
             logger.exception("Failed to load exchange rates.")
             raise
 
-    async def reload_exchange_rates(self, context: ContextTypes.DEFAULT_TYPE):
-        """Reload the exchange rates from the JSON file."""
+    async def reload_exchange_rates(self, context: ContextTypes.DEFAULT_TYPE = None):
+        """Reload the exchange rates from the storage without blocking the event loop."""
         try:
-            self.exchange_rates = self.load_exchange_rates()
+            async with self._reload_lock:
+                # Parse and index in a worker thread; handlers keep using the current index meanwhile
+                index = await asyncio.to_thread(self.load_exchange_rates)
+            # Swapped on the event loop thread with no await in between, so handlers never see a mix.
+            # Queried storages have no index, and the watcher only reloads them when they changed.
+            if index is None or index is not self.rates_index:
+                self.rates_index = index
+                self.rates_version += 1
+                self._cached_rates_message.cache_clear()
             logger.info(f"Exchange rates reloaded at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         except Exception as e:
             logger.exception("Failed to reload exchange rates.")
 
     def get_latest_rates(self):
-        """Get the latest date and rates for USD, RUB, and EUR."""
+        """Get the latest date, its rates and intraday rollups, and the previous day's rates."""
         try:
-            # Get the latest date (assuming the JSON is sorted by date)
-            sorted_dates = sorted(self.exchange_rates.keys(), reverse=True)
-            latest_date = sorted_dates[0]
-            previous_date = sorted_dates[1] if len(sorted_dates) > 1 else None
+            if self.rate_storage.supports_queries:
+                return self.rate_storage.latest_rates()
+
+            index = self.rates_index
+            latest_date, previous_date = index.latest_date, index.previous_date
+            if latest_date is None:
+                raise LookupError("No exchange rates loaded.")
 
-            latest_rates = self.exchange_rates[latest_date]["rates"]
-            previous_rates = self.exchange_rates[previous_date]["rates"] if previous_date else None
+            latest_rates = index.data[latest_date]["rates"]
+            previous_rates = index.data[previous_date]["rates"] if previous_date else None
+            latest_ohlc = index.data[latest_date].get("ohlc", {})
 
-            return latest_date, latest_rates, previous_rates
+            return latest_date, latest_rates, previous_rates, latest_ohlc
         except Exception as e:
             logger.exception("Failed to get latest rates.")
             raise
 
-    def format_rates_message(self, latest_date, latest_rates, previous_rates, currencies):
+    def format_rates_message(self, latest_date, latest_rates, previous_rates, latest_ohlc, currencies):
         """Format the exchange rates into a message."""
         message = f"📅 Latest rates as of <b>{latest_date}</b>:\n\n"
         for currency in currencies.split(","):
@@ -301,23 +1211,36 @@ class ExchangeRateBot:
                 message += (
                     f"🇺🇸 <b>{currency}</b>\n"
                     f"  Buying: {current_rate} {trend}\n"
-                    f"  Selling: {latest_rates[currency].get('sellingRate', 'N/A')}\n\n"
+                    f"  Selling: {latest_rates[currency].get('sellingRate', 'N/A')}\n"
                 )
+                # Show the intraday buying range when the rate moved during the day
+                buying = latest_ohlc.get(currency, {}).get("buyingRate")
+                if buying and buying["low"] != buying["high"]:
+                    message += f"  Today: {buying['low']} – {buying['high']}\n"
+                message += "\n"
         return message
 
+    def _render_rates_message(self, version, currencies):
+        """Render the rates message; called through the per-version cache."""
+        latest_date, latest_rates, previous_rates, latest_ohlc = self.get_latest_rates()
+        return self.format_rates_message(latest_date, latest_rates, previous_rates, latest_ohlc, ",".join(currencies))
+
+    def render_rates_message(self, currencies: str):
+        """Get the rates message for the currencies, rendering it once per data version."""
+        return self._cached_rates_message(self.rates_version, normalize_currencies(currencies))
+
     async def send_rates(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handler for the /rates command."""
         chat_id = update.message.chat_id
         try:
             # Get user's preferred currencies
-            user = self.db_handler.get_user(chat_id)
+            user = await self.db_handler.get_user(chat_id)
             if not user:
                 await update.message.reply_text("You are not subscribed. Use /start to subscribe.")
                 return
             _, currencies = user
 
-            latest_date, latest_rates, previous_rates = self.get_latest_rates()
-            message = self.format_rates_message(latest_date, latest_rates, previous_rates, currencies)
+            message = self.render_rates_message(currencies)
             await update.message.reply_text(message, parse_mode="HTML")
             logger.info(f"Rates sent to user {chat_id}.")
         except Exception as e:
@@ -348,32 +1271,38 @@ class ExchangeRateBot:
         # Process the currency code
         await self.process_currency_rates(update, context, currency)
 
+    def get_buying_rate_history(self, currency: str):
+        """Get the buying rates of the last 10 records, spaced every two days."""
+        if self.rate_storage.supports_queries:
+            selected_dates = RatesIndex.select_history_dates(self.rate_storage.dates())
+            return self.rate_storage.currency_history(currency, selected_dates)
+
+        # Extract buying rates for the dates selected when the rates were loaded
+        index = self.rates_index
+        buying_rates = []
+        for date in index.history_dates:
+            rates = index.data[date]["rates"]
+            if currency in rates:
+                buying_rate = rates[currency].get("buyingRate", 0)
+                buying_rates.append((date, buying_rate))
+            else:
+                buying_rates.append((date, None))  # Add None for missing data
+        return buying_rates
+
     async def process_currency_rates(self, update: Update, context: ContextTypes.DEFAULT_TYPE, currency: str):
         """Process the currency rates for the given currency."""
         chat_id = update.message.chat_id  # Extract chat_id from the update object
 
         try:
-            # Get the last 10 records, spaced every two days
-            sorted_dates = sorted(self.exchange_rates.keys(), reverse=True)
-            selected_dates = []
-            current_date = datetime.strptime(sorted_dates[0], "%Y-%m-%d")
-
-            for date in sorted_dates:
-                date_obj = datetime.strptime(date, "%Y-%m-%d")
-                if (current_date - date_obj).days % 2 == 0:
-                    selected_dates.append(date)
-                    if len(selected_dates) >= 10:
-                        break
-
-            # Extract buying rates for the selected dates
-            buying_rates = []
-            for date in selected_dates:
-                rates = self.exchange_rates[date]["rates"]
-                if currency in rates:
-                    buying_rate = rates[currency].get("buyingRate", 0)
-                    buying_rates.append((date, buying_rate))
-                else:
-                    buying_rates.append((date, None))  # Add None for missing data
+            # Slice the memory-mapped archive when there is one
+            date_range = self.rate_archive.date_range() if self.rate_archive else None
+            if date_range:
+                first_date, latest_date = date_range
+                latest = datetime.fromisoformat(latest_date)
+                selected_dates = [(latest - timedelta(days=2 * i)).date().isoformat() for i in range(10)]
+                buying_rates = self.rate_archive.history(currency, [d for d in selected_dates if d >= first_date])
+            else:
+                buying_rates = self.get_buying_rate_history(currency)
 
             if not buying_rates:
                 await update.message.reply_text(f"No data found for currency {currency}.")
@@ -411,48 +1340,157 @@ class ExchangeRateBot:
             await update.message.reply_text("An error occurred. Please try again later.")
 
     async def send_daily_rates(self, context: ContextTypes.DEFAULT_TYPE):
-        """Send the daily exchange rates to users whose local time is 10:00 AM."""
-        try:
-            latest_date, latest_rates, previous_rates = self.get_latest_rates()
-
-            # Fetch all users
-            users = self.db_handler.get_all_users()
-            for user in users:
-                chat_id, timezone, currencies, offset = user  # Include offset in the query
-                try:
-                    # Calculate the user's local time based on their integer offset
-                    now_utc = datetime.utcnow()
-                    user_local_time = now_utc + timedelta(hours=offset)
-
-                    # Check if it's 10:00 AM in the user's local time
-                    if user_local_time.hour == 10 and user_local_time.minute == 0:
-                        message = self.format_rates_message(latest_date, latest_rates, previous_rates, currencies)
-                        await self.application.bot.send_message(chat_id=chat_id, text=message, parse_mode="HTML")
-                        logger.info(f"Daily rates sent to user {chat_id} in timezone {timezone} (offset: UTC{offset:+d}).")
-                except Exception as e:
-                    logger.exception(f"Failed to send daily rates to user {chat_id}.")
-        except Exception as e:
-            logger.exception("Failed to send daily rates.")
+        """Send the daily exchange rates to users whose next delivery is due."""
+        retry_delay = 0
+        async with self._delivery_lock:
+            try:
+                # Fail early if no rates are available
+                self.get_latest_rates()
+
+                # 1. Queue the users whose next_delivery_utc has passed, found through its index
+                now = int(time.time())
+                users = await self.db_handler.get_due_users(now)
+                if users:
+                    # Bucket users by their normalized currency list and render once per bucket
+                    buckets = {}
+                    for chat_id, timezone, currencies, due in users:
+                        buckets.setdefault(normalize_currencies(currencies), []).append((chat_id, timezone, due))
+                    payloads = [self._cached_rates_message(self.rates_version, currencies) for currencies in buckets]
+                    deliveries = [
+                        (chat_id, timezone, due, index)
+                        for index, bucket in enumerate(buckets.values())
+                        for chat_id, timezone, due in bucket
+                    ]
+                    await self.db_handler.enqueue_deliveries(payloads, deliveries, now)
+
+                # 2. Drain the outbox, including retries and anything left over from a restart
+                await self.drain_outbox()
+            except Exception as e:
+                logger.exception("Failed to send daily rates.")
+                # Due users and deliveries are still due, so back off instead of firing again immediately
+                retry_delay = 60
+        await self.schedule_delivery_job(retry_delay)
+
+    async def drain_outbox(self):
+        """Send pending outbox deliveries in batches until none are due."""
+        sent = failed = 0
+        unreachable = []
+        started = time.monotonic()
+
+        async def record(message, error):
+            chat_id, _, delivery_date, attempts = message
+            try:
+                if error is None:
+                    await self.db_handler.mark_delivered(chat_id, delivery_date, int(time.time()))
+                elif is_unreachable(error):
+                    # Blocked or deleted chats would fail every day, so stop delivering to them
+                    unreachable.append(chat_id)
+                    await self.db_handler.mark_failed(chat_id, delivery_date)
+                    if self.inactive_grace_count is None:
+                        await self.db_handler.deactivate_user(chat_id, int(time.time()))
+                    elif await self.db_handler.count_unreachable(chat_id) >= self.inactive_grace_count:
+                        logger.info(f"User {chat_id} unreachable {self.inactive_grace_count} times in a row.")
+                        await self.db_handler.delete_user(chat_id)
+                elif not is_retryable(error) or attempts + 1 >= MAX_DELIVERY_ATTEMPTS:
+                    logger.error(f"Giving up on daily rates for user {chat_id} after {attempts + 1} attempts.")
+                    await self.db_handler.mark_failed(chat_id, delivery_date)
+                else:
+                    delay = min(DELIVERY_RETRY_DELAY * 2 ** attempts, MAX_DELIVERY_RETRY_DELAY)
+                    await self.db_handler.mark_failed(chat_id, delivery_date, int(time.time() + delay))
+            except Exception as e:
+                logger.exception(f"Failed to record the delivery to user {chat_id}.")
+
+        while True:
+            # Claimed rows leave the due set, so each batch picks up where the last one ended. A row
+            # whose outcome could not be recorded is only due again once its lease expires.
+            now = int(time.time())
+            batch = await self.db_handler.claim_deliveries(now, self.outbox_batch_size, now + DELIVERY_LEASE)
+            if not batch:
+                break
+
+            # Rows come grouped by payload, so each body is fetched once and shared by its chats
+            bodies = await self.db_handler.get_payloads({payload_id for _, payload_id, _, _ in batch})
+            messages = (
+                (chat_id, bodies[payload_id], delivery_date, attempts)
+                for chat_id, payload_id, delivery_date, attempts in batch
+            )
+            stats = await self.sender.send_many(messages, on_result=record, parse_mode="HTML")
+            sent += stats["sent"]
+            failed += stats["failed"]
+
+        if sent or failed:
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"Daily rates sent to {sent} users in {elapsed:.1f} seconds, {failed} failed "
+                f"({len(unreachable)} unreachable)."
+            )
 
+        cutoff = datetime.now(pytz.utc) - timedelta(days=OUTBOX_RETENTION_DAYS)
+        await self.db_handler.prune_outbox(cutoff.date().isoformat())
+        if self.inactive_grace_days is not None:
+            await self.db_handler.delete_inactive_users(int(time.time() - self.inactive_grace_days * 86400))
 
-    def start_scheduler(self):
-        """Start the scheduler after the bot is running."""
-        # Schedule send_daily_rates to run every hour
-        self.application.job_queue.run_repeating(self.send_daily_rates, interval=3600)
+    async def schedule_delivery_job(self, min_delay: float = 0):
+        """Schedule send_daily_rates for the earliest due delivery, checking at least every delivery_check_interval."""
+        if not self.deliveries_enabled:
+            return
+        try:
+            due = await self.db_handler.get_next_delivery()
+        except Exception as e:
+            logger.exception("Failed to schedule daily rates.")
+            due = None
+        now = time.time()
+        when = now + self.delivery_check_interval if due is None else min(due, now + self.delivery_check_interval)
+        delay = max(when - now, min_delay, 0)
 
-        # Schedule reload_exchange_rates to run every hour at the 5th minute
-        self.application.job_queue.run_repeating(self.reload_exchange_rates, interval=3600, first=300)
+        # Only one pending delivery job at a time; a job that is already running is not listed
+        for job in self.application.job_queue.get_jobs_by_name("daily-rates"):
+            job.schedule_removal()
+        self.application.job_queue.run_once(self.send_daily_rates, when=delay, name="daily-rates")
+        logger.info(f"Next daily rates check in {delay:.0f} seconds.")
 
-        logger.info("Scheduler started.")
 
     def run(self):
-        self.start_scheduler()
-        self.application.run_polling()
-
-    def __del__(self):
-        """Clean up resources when the bot is shut down."""
-        self.db_handler.close()
-        logger.info("Bot shut down and resources cleaned up.")
+        # Long polling unless a public webhook URL is configured
+        webhook_url = os.getenv("TELEGRAM_WEBHOOK_URL")
+        if not webhook_url:
+            self.application.run_polling()
+            return
+        self.run_webhook(webhook_url)
+
+    def run_webhook(self, webhook_url: str):
+        """Receive updates through PTB's built-in webhook server instead of long polling.
+
+        With TELEGRAM_WEBHOOK_CERT and TELEGRAM_WEBHOOK_KEY set the server terminates TLS itself;
+        otherwise it serves plain HTTP for a reverse proxy that terminates TLS in front of it.
+
+        Several instances can only run behind one load balancer if they share users.db on the
+        same host: set USERS_DB_SHARED=1 on all of them and DAILY_RATES_ENABLED=0 on all but one.
+        """
+        listen = os.getenv("TELEGRAM_WEBHOOK_LISTEN", "0.0.0.0")
+        port = int(os.getenv("TELEGRAM_WEBHOOK_PORT", "8443"))
+        # By default serve the path of the public URL, which is what a proxy usually forwards
+        url_path = os.getenv("TELEGRAM_WEBHOOK_PATH", urlsplit(webhook_url).path.lstrip("/"))
+        secret_token = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+        cert = os.getenv("TELEGRAM_WEBHOOK_CERT")
+        key = os.getenv("TELEGRAM_WEBHOOK_KEY")
+
+        if not secret_token:
+            logger.warning("TELEGRAM_WEBHOOK_SECRET is not set; webhook requests will not be authenticated.")
+        if bool(cert) != bool(key):
+            raise ValueError("Set both TELEGRAM_WEBHOOK_CERT and TELEGRAM_WEBHOOK_KEY, or neither for reverse-proxy mode.")
+
+        mode = "TLS" if cert else "reverse-proxy"
+        logger.info(f"Serving webhook on {listen}:{port}/{url_path} for {webhook_url} ({mode} mode).")
+        self.application.run_webhook(
+            listen=listen,
+            port=port,
+            url_path=url_path,
+            webhook_url=webhook_url,
+            secret_token=secret_token,
+            cert=cert,
+            key=key,
+        )
 
 
 if __name__ == "__main__":
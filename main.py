@@ -1,26 +1,201 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
 import base64
+import hashlib
 import re
 import json
 import os
+import argparse
+import bisect
+import math
+import mmap
+import random
+import signal
+import sqlite3
+import struct
+import tempfile
+import threading
 from datetime import datetime, timedelta
 import fcntl  # For Unix-based systems
 import logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("exchange_rate_script.log"),  # Log to a file
-        logging.StreamHandler()  # Log to console
-    ]
-)
 logger = logging.getLogger(__name__)
 
+
+def configure_logging():
+    """Configure logging for the scraper (not done on import, as bot.py imports the storage classes)."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.FileHandler("exchange_rate_script.log"),  # Log to a file
+            logging.StreamHandler()  # Log to console
+        ]
+    )
+
+
+RATE_FIELDS = ("buyingRate", "sellingRate")
+
+
+def merge_snapshot(day_record, snapshot):
+    """Add a snapshot to a day's record and return the updated record.
+
+    A day record keeps every snapshot of the day keyed by timestamp, the latest
+    ``timestamp``/``rates`` pair and per-currency open/high/low/close rollups, so
+    readers get the latest rates and the intraday range without scanning snapshots.
+    Records written before intraday history existed are treated as the day's first snapshot.
+    """
+    timestamp, rates = snapshot["timestamp"], snapshot["rates"]
+    if day_record is None:
+        day_record = {}
+    elif "snapshots" not in day_record:
+        day_record = merge_snapshot(None, day_record)
+
+    snapshots = dict(day_record.get("snapshots", {}))
+    snapshots[timestamp] = rates
+    record = {
+        "timestamp": day_record.get("timestamp", timestamp),
+        "rates": day_record.get("rates", rates),
+        "snapshots": snapshots,
+        "ohlc": dict(day_record.get("ohlc", {})),
+    }
+    is_latest = timestamp >= record["timestamp"]
+    if is_latest:
+        record["timestamp"], record["rates"] = timestamp, rates
+
+    for currency, currency_rates in rates.items():
+        rollup = {field: dict(values) for field, values in record["ohlc"].get(currency, {}).items()}
+        for field in RATE_FIELDS:
+            rate = currency_rates.get(field)
+            if rate is None:
+                continue
+            if field not in rollup:
+                rollup[field] = {"open": rate, "high": rate, "low": rate, "close": rate}
+                continue
+            rollup[field]["high"] = max(rollup[field]["high"], rate)
+            rollup[field]["low"] = min(rollup[field]["low"], rate)
+            if is_latest:
+                rollup[field]["close"] = rate
+        record["ohlc"][currency] = rollup
+    return record
+
+
+def downsample_day(day_record):
+    """Reduce a day's record to its closing rates and OHLC rollups, dropping the snapshots."""
+    if "ohlc" not in day_record:
+        day_record = merge_snapshot(None, day_record)
+    return {
+        "period": "day",
+        "timestamp": day_record["timestamp"],
+        "rates": day_record["rates"],
+        "ohlc": day_record["ohlc"],
+    }
+
+
+def merge_rollup(week_record, day_record):
+    """Fold a downsampled day record into its week's record and return the updated week record.
+
+    Days must be folded in chronological order so the day's rates become the week's close.
+    """
+    ohlc = {currency: {field: dict(values) for field, values in fields.items()}
+            for currency, fields in (week_record or {}).get("ohlc", {}).items()}
+    for currency, fields in day_record["ohlc"].items():
+        rollup = ohlc.setdefault(currency, {})
+        for field, values in fields.items():
+            if field not in rollup:
+                rollup[field] = dict(values)
+                continue
+            rollup[field]["high"] = max(rollup[field]["high"], values["high"])
+            rollup[field]["low"] = min(rollup[field]["low"], values["low"])
+            rollup[field]["close"] = values["close"]
+    return {
+        "period": "week",
+        "timestamp": day_record["timestamp"],
+        "rates": day_record["rates"],
+        "ohlc": ohlc,
+    }
+
+
+def week_start(date):
+    """Return the Monday of the ISO week containing the ISO date."""
+    day = datetime.fromisoformat(date).date()
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+
+class RetentionPolicy:
+    """How long history is kept at each resolution.
+
+    Snapshots are kept for ``raw_days``, then reduced to one OHLC record per day until they
+    are ``daily_days`` old, then merged into one OHLC record per ISO week (keyed by its Monday)
+    that is kept for ``weekly_days``, or forever if it is None.
+    """
+
+    def __init__(self, raw_days=14, daily_days=365, weekly_days=None):
+        self.raw_days = raw_days
+        self.daily_days = max(daily_days, raw_days)
+        self.weekly_days = weekly_days
+
+    def cutoffs(self):
+        """Return the (raw, daily, weekly) cutoff dates; records before a cutoff leave that tier."""
+        today = datetime.now().date()
+
+        def cutoff(days):
+            return (today - timedelta(days=days)).isoformat() if days is not None else None
+
+        return cutoff(self.raw_days), cutoff(self.daily_days), cutoff(self.weekly_days)
+
+
+def replace_file(file_path, write, mode=None):
+    """Write a new version of the file next to it, fsync it and atomically rename it into place.
+
+    Readers never need a lock: they see either the old or the new file, never a partial one.
+    ``mode`` sets the permissions; by default the existing file's are kept (0644 for a new file).
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(file_path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        # mkstemp creates the file as 0600; keep the permissions readers already rely on
+        if mode is None:
+            try:
+                mode = os.stat(file_path).st_mode & 0o777
+            except FileNotFoundError:
+                mode = 0o644
+        if mode != 0o600:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # Persist the rename itself
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return os.stat(file_path)
+
+
 class ExchangeRateStorage:
-    def __init__(self, file_path="exchange_rates.json"):
+    # Whether the storage answers latest/history queries itself instead of via load_data()
+    supports_queries = False
+
+    def __init__(self, file_path="exchange_rates.json", retention=None):
         self.file_path = file_path
+        self.retention = retention or RetentionPolicy()
+        # Cutoffs of the last retention pass; records before them were already downsampled
+        self._retention_cutoffs = None
+        # In-memory copy of the dataset, reused while the file is not changed by anyone else
+        self._data = None
+        self._signature = None
+        self.heartbeat_path = f"{file_path}.heartbeat"
+        self._heartbeat = self._load_heartbeat()
         # Create the file if it doesn't exist
         if not os.path.exists(self.file_path):
             with open(self.file_path, 'w') as file:
@@ -37,63 +212,891 @@ class ExchangeRateStorage:
         fcntl.flock(file, fcntl.LOCK_UN)  # Unlock the file
         logger.debug("File lock released.")
 
+    @staticmethod
+    def _file_signature(stat):
+        """Return a value that changes whenever the file is rewritten."""
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _replace_file(self, write, file_path=None):
+        """Atomically replace the data file, or another file of this storage, see replace_file()."""
+        return replace_file(file_path or self.file_path, write)
+
+    @staticmethod
+    def hash_rates(rates):
+        """Return a content hash of the rates that does not depend on key order."""
+        payload = json.dumps(rates, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()
+
+    def _load_heartbeat(self):
+        """Load the freshness marker written alongside the data file."""
+        try:
+            with open(self.heartbeat_path, 'r') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def write_heartbeat(self, rates_hash, timestamp, changed):
+        """Record when the rates were last checked and when they last changed."""
+        self._heartbeat = {
+            "checked_at": timestamp,
+            "changed_at": timestamp if changed else self._heartbeat.get("changed_at"),
+            "hash": rates_hash,
+        }
+        self._replace_file(lambda file: file.write(json.dumps(self._heartbeat).encode('utf-8')), self.heartbeat_path)
+
+    def is_unchanged(self, data, date, rates_hash):
+        """Return True if the date already has a record and the rates match the last ones stored."""
+        return date in data and rates_hash == self._heartbeat.get("hash")
+
     def load_data(self):
-        """Load data from the file."""
+        """Load data from the file, reusing the in-memory copy if the file is unchanged."""
+        if self._data is not None and self._signature == self._file_signature(os.stat(self.file_path)):
+            logger.info("Using in-memory data.")
+            return self._data
+
         logger.info("Loading data from file...")
         with open(self.file_path, 'r') as file:
+            # Taken from the open file, so a concurrent replace cannot pair old data with a new signature
+            signature = self._file_signature(os.fstat(file.fileno()))
             try:
                 data = json.load(file)
                 logger.info("Data loaded successfully.")
             except json.JSONDecodeError:
                 logger.warning("File is empty or corrupted. Starting with an empty dataset.")
                 data = {}
+        self._data = data
+        self._signature = signature
         return data
 
     def save_data(self, data):
-        """Save data to the file, ensuring only one process writes at a time."""
+        """Save data to the file by atomically replacing it."""
         logger.info("Saving data to file...")
-        with open(self.file_path, 'w') as file:
-            self._acquire_lock(file)  # Lock the file for writing
-            try:
-                json.dump(data, file, indent=4)
-                logger.info(f"Data saved successfully to {self.file_path}.")
-            finally:
-                self._release_lock(file)  # Release the lock
+        stat = self._replace_file(lambda file: file.write(json.dumps(data, indent=4).encode('utf-8')))
+        logger.info(f"Data saved successfully to {self.file_path}.")
+        self._data = data
+        self._signature = self._file_signature(stat)
 
-    def update_or_add_record(self, new_record):
-        """Update the record for the current day or add a new record."""
+    def latest_stored_rates(self):
+        """Return the rates of the most recent record, or None if nothing is stored."""
         data = self.load_data()
+        if not data:
+            return None
+        return data[max(data)]["rates"]
 
+    def update_or_add_record(self, new_record):
+        """Add a snapshot to the record for the current day. Returns False if the rates were unchanged."""
         # Get today's date in ISO format (e.g., "2023-10-25")
         today = datetime.now().date().isoformat()
+
+        # Unchanged rates only refresh the heartbeat instead of rewriting the dataset
+        rates_hash = self.hash_rates(new_record["rates"])
+        if self.is_unchanged(self.load_data(), today, rates_hash):
+            logger.info("Exchange rates unchanged. Updating heartbeat only.")
+            self.write_heartbeat(rates_hash, new_record["timestamp"], changed=False)
+            return False
+
+        # Copy so the in-memory data is only replaced once the save succeeds
+        data = dict(self.load_data())
         logger.info(f"Updating or adding record for date: {today}")
 
-        # Update or add the record for today
-        data[today] = new_record
+        # Add the snapshot to today's record
+        data[today] = merge_snapshot(data.get(today), new_record)
+
+        self.save_data(self.apply_retention(data))
+        self.write_heartbeat(rates_hash, new_record["timestamp"], changed=True)
+        return True
+
+    def apply_retention(self, data):
+        """Downsample the records that aged out of a retention tier since the last pass.
 
-        # Remove entries older than 14 days
-        cutoff_date = datetime.now() - timedelta(days=14)
-        data = {k: v for k, v in data.items() if datetime.fromisoformat(k).date() >= cutoff_date.date()}
+        The cutoffs only move once a day, so most calls return the data unchanged.
+        """
+        cutoffs = self.retention.cutoffs()
+        if cutoffs == self._retention_cutoffs:
+            return data
+        raw_cutoff, daily_cutoff, weekly_cutoff = cutoffs
+        previous_raw, previous_daily, previous_weekly = self._retention_cutoffs or ("", "", "")
+        data = dict(data)
 
-        self.save_data(data)
+        # ISO dates sort lexically, so no parsing is needed
+        for date in sorted(k for k in data if previous_raw <= k < raw_cutoff):
+            if data[date].get("period") is None:
+                data[date] = downsample_day(data[date])
+
+        for date in sorted(k for k in data if previous_daily <= k < daily_cutoff):
+            if data[date].get("period") == "day":
+                record = data.pop(date)
+                week = week_start(date)
+                data[week] = merge_rollup(data.get(week), record)
+
+        if weekly_cutoff:
+            for date in [k for k in data if (previous_weekly or "") <= k < weekly_cutoff]:
+                del data[date]
+
+        self._retention_cutoffs = cutoffs
+        return data
+
+    def close(self):
+        """Release any resources held by the storage."""
+
+
+class ExchangeRateLogStorage(ExchangeRateStorage):
+    """Append-only storage: one compact JSON line per snapshot, compacted in the background.
+
+    Snapshot lines are ``{"date": ..., "snapshot": ...}`` and are merged into the day's
+    record on replay; compaction rewrites the file as one ``{"date": ..., "record": ...}``
+    line per date with the retention policy applied, once per day or after ``compact_every``
+    snapshot lines.
+    """
+
+    def __init__(self, file_path="exchange_rates.jsonl", retention=None, compact_every=288):
+        self.file_path = file_path
+        self.retention = retention or RetentionPolicy()
+        self._retention_cutoffs = None
+        self.compact_every = compact_every
+        self._data = None
+        # Kept open so the replayed file's inode cannot be reused by a later file
+        self._file = None
+        self._offset = 0
+        self._snapshot_lines = 0
+        self._lock = threading.RLock()
+        self.heartbeat_path = f"{file_path}.heartbeat"
+        self._heartbeat = self._load_heartbeat()
+        self._compaction = None
+        # Create the file if it doesn't exist
+        if not os.path.exists(self.file_path):
+            open(self.file_path, 'a').close()
+            logger.info(f"Created new file: {self.file_path}")
+
+    @staticmethod
+    def _encode(entry):
+        return (json.dumps(entry, separators=(',', ':')) + "\n").encode('utf-8')
+
+    def _open_locked(self):
+        """Open the current file for appending and take its exclusive lock.
+
+        Compaction holds the lock while it replaces the file, so a writer that was waiting
+        may wake up holding the old, already replaced inode; it then retries on the new file.
+        """
+        while True:
+            file = open(self.file_path, 'ab')
+            self._acquire_lock(file)
+            try:
+                if os.fstat(file.fileno()).st_ino == os.stat(self.file_path).st_ino:
+                    return file
+            except FileNotFoundError:
+                pass
+            self._release_lock(file)
+            file.close()
+
+    def load_data(self):
+        """Load data from the file, replaying only the lines appended since the last load."""
+        with self._lock:
+            stat = os.stat(self.file_path)
+            current = self._file is not None and os.fstat(self._file.fileno()).st_ino == stat.st_ino
+            if self._data is not None and current and stat.st_size >= self._offset:
+                if stat.st_size == self._offset:
+                    logger.info("Using in-memory data.")
+                    return self._data
+                # Replay into a copy: callers may still be reading the dict they were given, and a
+                # new object tells them the data changed (day records are never mutated in place)
+                data = dict(self._data)
+            else:
+                # First load, or the file was compacted by another process
+                logger.info("Loading data from file...")
+                data = {}
+                if self._file:
+                    self._file.close()
+                self._file = open(self.file_path, 'rb')
+                self._offset = 0
+                self._snapshot_lines = 0
+
+            file = self._file
+            file.seek(self._offset)
+            for line in file:
+                if not line.endswith(b"\n"):
+                    # A write in progress; it will be picked up by the next load
+                    break
+                self._offset += len(line)
+                try:
+                    entry = json.loads(line)
+                    date = entry["date"]
+                    if "snapshot" in entry:
+                        data[date] = merge_snapshot(data.get(date), entry["snapshot"])
+                        self._snapshot_lines += 1
+                    else:
+                        data[date] = entry["record"]
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    logger.warning(f"Skipping corrupted line in {self.file_path}.")
+
+            self._data = data
+            logger.info("Data loaded successfully.")
+            return data
+
+    def save_data(self, data):
+        """Rewrite the whole file with one line per date."""
+        with self._lock:
+            logger.info("Saving data to file...")
+            held = []
+
+            def write(file):
+                file.writelines(self._encode({"date": date, "record": data[date]}) for date in sorted(data))
+                # Lock the new file before it is renamed into place, through a duplicate descriptor
+                # that outlives the write, so nobody appends to it until it has been reopened below
+                held.append(os.dup(file.fileno()))
+                self._acquire_lock(held[0])
+
+            try:
+                self._replace_file(write)
+                if self._file:
+                    self._file.close()
+                self._file = open(self.file_path, 'rb')
+                self._offset = os.fstat(self._file.fileno()).st_size
+            finally:
+                if held:
+                    os.close(held[0])
+            self._data = data
+            self._snapshot_lines = 0
+            logger.info(f"Data saved successfully to {self.file_path}.")
+
+    def update_or_add_record(self, new_record):
+        """Append a snapshot for the current day. Returns False if the rates were unchanged."""
+        today = datetime.now().date().isoformat()
+        rates_hash = self.hash_rates(new_record["rates"])
+        with self._lock:
+            # Held from the replay to the append, so no other process appends or compacts in between
+            file = self._open_locked()
+            try:
+                data = self.load_data()
+                if self.is_unchanged(data, today, rates_hash):
+                    logger.info("Exchange rates unchanged. Updating heartbeat only.")
+                    self.write_heartbeat(rates_hash, new_record["timestamp"], changed=False)
+                    return False
+
+                logger.info(f"Appending snapshot for date: {today}")
+                new_day = today not in data
+                line = self._encode({"date": today, "snapshot": new_record})
+                file.write(line)
+                file.flush()
+            finally:
+                self._release_lock(file)
+                file.close()
+            self._offset += len(line)
+            self._snapshot_lines += 1
+            data = dict(data)
+            data[today] = merge_snapshot(data.get(today), new_record)
+            self._data = data
+            self.write_heartbeat(rates_hash, new_record["timestamp"], changed=True)
+
+        # Retention only changes when a day starts; snapshot lines only slow down replay
+        if new_day or self._snapshot_lines >= self.compact_every:
+            self.compact_in_background()
+        return True
+
+    def compact(self):
+        """Rewrite the file as one record per date with the retention policy applied."""
+        with self._lock:
+            logger.info(f"Compacting {self.file_path}...")
+            # Lock the current file until it is replaced, so no append can land in the old inode
+            file = self._open_locked()
+            try:
+                self.save_data(self.apply_retention(self.load_data()))
+            finally:
+                self._release_lock(file)
+                file.close()
+
+    def compact_in_background(self):
+        """Start a compaction in a background thread unless one is already running."""
+        if self._compaction and self._compaction.is_alive():
+            return
+        self._compaction = threading.Thread(target=self._compact_safely, name="compaction", daemon=True)
+        self._compaction.start()
+
+    def _compact_safely(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logger.exception(f"Compaction failed with error: {e}")
+
+    def close(self):
+        """Wait for a running compaction to finish and close the file."""
+        if self._compaction:
+            self._compaction.join()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class SQLiteExchangeRateStorage(ExchangeRateStorage):
+    """SQLite storage: a snapshots table and a rates table indexed by currency and time.
+
+    Readers query the latest rates and per-currency history directly instead of loading
+    the whole history into memory. Snapshots that age out of the raw retention tier are
+    downsampled into the rollups table, one row per (period, date, currency).
+    """
+
+    supports_queries = True
+
+    def __init__(self, file_path="exchange_rates.db", retention=None):
+        self.file_path = file_path
+        self.retention = retention or RetentionPolicy()
+        self._retention_cutoffs = None
+        self.heartbeat_path = f"{file_path}.heartbeat"
+        self._heartbeat = self._load_heartbeat()
+        # Shared between threads, so every use of the connection goes through the lock
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.file_path, check_same_thread=False)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        # WAL lets the bot read while the scraper writes
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    id INTEGER PRIMARY KEY,
+                    timestamp TEXT NOT NULL UNIQUE,
+                    date TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_snapshots_date ON snapshots (date, timestamp);
+                CREATE TABLE IF NOT EXISTS rates (
+                    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+                    currency TEXT NOT NULL,
+                    country_name TEXT,
+                    buying REAL,
+                    selling REAL,
+                    PRIMARY KEY (snapshot_id, currency)
+                );
+                CREATE INDEX IF NOT EXISTS idx_rates_currency ON rates (currency, snapshot_id);
+                CREATE TABLE IF NOT EXISTS rollups (
+                    period TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    currency TEXT NOT NULL,
+                    country_name TEXT,
+                    timestamp TEXT NOT NULL,
+                    buying_open REAL,
+                    buying_high REAL,
+                    buying_low REAL,
+                    buying_close REAL,
+                    selling_open REAL,
+                    selling_high REAL,
+                    selling_low REAL,
+                    selling_close REAL,
+                    PRIMARY KEY (period, date, currency)
+                );
+                CREATE INDEX IF NOT EXISTS idx_rollups_currency ON rollups (currency, date);
+            """)
+        logger.info(f"Opened SQLite storage: {self.file_path}")
+
+    def _snapshot_rates(self, snapshot_id):
+        """Return the rates of a snapshot in the same shape the scraper stores them."""
+        rows = self.conn.execute(
+            "SELECT currency, country_name, buying, selling FROM rates WHERE snapshot_id = ?",
+            (snapshot_id,),
+        )
+        return {
+            currency: {"countryName": country_name, "buyingRate": buying, "sellingRate": selling}
+            for currency, country_name, buying, selling in rows
+        }
+
+    def _load_rollup(self, period, date):
+        """Return a rollup as a record in the shape of downsample_day/merge_rollup, or None."""
+        rows = self.conn.execute(
+            "SELECT currency, country_name, timestamp, buying_open, buying_high, buying_low, buying_close, "
+            "selling_open, selling_high, selling_low, selling_close FROM rollups WHERE period = ? AND date = ?",
+            (period, date),
+        ).fetchall()
+        if not rows:
+            return None
+        record = {"period": period, "timestamp": max(row[2] for row in rows), "rates": {}, "ohlc": {}}
+        for currency, country_name, _, *values in rows:
+            record["rates"][currency] = {"countryName": country_name}
+            record["ohlc"][currency] = {}
+            for field, (open_, high, low, close) in zip(RATE_FIELDS, (values[:4], values[4:])):
+                record["rates"][currency][field] = close
+                if open_ is not None:
+                    record["ohlc"][currency][field] = {"open": open_, "high": high, "low": low, "close": close}
+        return record
+
+    def _save_rollup(self, period, date, record):
+        """Replace the rollup rows for the period and date with the record."""
+        self.conn.execute("DELETE FROM rollups WHERE period = ? AND date = ?", (period, date))
+        rows = []
+        for currency, rate in record["rates"].items():
+            fields = record["ohlc"].get(currency, {})
+            values = []
+            for field in RATE_FIELDS:
+                rollup = fields.get(field, {})
+                values += [rollup.get("open"), rollup.get("high"), rollup.get("low"), rollup.get("close")]
+            rows.append((period, date, currency, rate.get("countryName"), record["timestamp"], *values))
+        self.conn.executemany(
+            "INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+
+    def _apply_retention(self, cutoffs):
+        """Downsample snapshots and daily rollups that aged out of their tier, within the caller's transaction."""
+        raw_cutoff, daily_cutoff, weekly_cutoff = cutoffs
+
+        aged_dates = self.conn.execute(
+            "SELECT DISTINCT date FROM snapshots WHERE date < ? ORDER BY date", (raw_cutoff,)
+        ).fetchall()
+        for (date,) in aged_dates:
+            record = None
+            snapshots = self.conn.execute(
+                "SELECT id, timestamp FROM snapshots WHERE date = ? ORDER BY timestamp", (date,)
+            ).fetchall()
+            for snapshot_id, timestamp in snapshots:
+                record = merge_snapshot(record, {"timestamp": timestamp, "rates": self._snapshot_rates(snapshot_id)})
+            self._save_rollup("day", date, downsample_day(record))
+            # Rates of removed snapshots are deleted by the foreign key cascade
+            self.conn.execute("DELETE FROM snapshots WHERE date = ?", (date,))
+
+        aged_days = self.conn.execute(
+            "SELECT DISTINCT date FROM rollups WHERE period = 'day' AND date < ? ORDER BY date", (daily_cutoff,)
+        ).fetchall()
+        for (date,) in aged_days:
+            week = week_start(date)
+            self._save_rollup("week", week, merge_rollup(self._load_rollup("week", week), self._load_rollup("day", date)))
+            self.conn.execute("DELETE FROM rollups WHERE period = 'day' AND date = ?", (date,))
+
+        if weekly_cutoff:
+            self.conn.execute("DELETE FROM rollups WHERE period = 'week' AND date < ?", (weekly_cutoff,))
+
+    def load_data(self):
+        """Load the whole history as date-keyed records (prefer the query methods)."""
+        logger.info("Loading data from SQLite...")
+        data = {}
+        with self._lock:
+            rollups = self.conn.execute("SELECT DISTINCT period, date FROM rollups ORDER BY date").fetchall()
+            for period, date in rollups:
+                data[date] = self._load_rollup(period, date)
+            snapshots = self.conn.execute("SELECT id, timestamp, date FROM snapshots ORDER BY id").fetchall()
+            for snapshot_id, timestamp, date in snapshots:
+                snapshot = {"timestamp": timestamp, "rates": self._snapshot_rates(snapshot_id)}
+                data[date] = merge_snapshot(data.get(date), snapshot)
+        logger.info("Data loaded successfully.")
+        return data
+
+    def update_or_add_record(self, new_record):
+        """Insert a snapshot for the current day. Returns False if the rates were unchanged."""
+        today = datetime.now().date().isoformat()
+        rates_hash = self.hash_rates(new_record["rates"])
+        with self._lock:
+            has_today = self.conn.execute("SELECT 1 FROM snapshots WHERE date = ? LIMIT 1", (today,)).fetchone()
+            if has_today and rates_hash == self._heartbeat.get("hash"):
+                logger.info("Exchange rates unchanged. Updating heartbeat only.")
+                self.write_heartbeat(rates_hash, new_record["timestamp"], changed=False)
+                return False
+
+            logger.info(f"Inserting snapshot for date: {today}")
+            cutoffs = self.retention.cutoffs()
+            with self.conn:
+                cursor = self.conn.execute(
+                    "INSERT INTO snapshots (timestamp, date) VALUES (?, ?)",
+                    (new_record["timestamp"], today),
+                )
+                self.conn.executemany(
+                    "INSERT INTO rates (snapshot_id, currency, country_name, buying, selling) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (cursor.lastrowid, currency, rate.get("countryName"), rate.get("buyingRate"), rate.get("sellingRate"))
+                        for currency, rate in new_record["rates"].items()
+                    ],
+                )
+                # The cutoffs only move once a day, so most writes skip the retention pass
+                if cutoffs != self._retention_cutoffs:
+                    self._apply_retention(cutoffs)
+            self._retention_cutoffs = cutoffs
+            self.write_heartbeat(rates_hash, new_record["timestamp"], changed=True)
+        return True
+
+    def latest_stored_rates(self):
+        """Return the rates of the most recent snapshot, or None if nothing is stored."""
+        with self._lock:
+            latest = self.conn.execute("SELECT id FROM snapshots ORDER BY id DESC LIMIT 1").fetchone()
+            return self._snapshot_rates(latest[0]) if latest else None
+
+    def latest_rates(self):
+        """Return the latest date, its latest rates, the previous day's rates and the latest day's OHLC."""
+        with self._lock:
+            latest = self.conn.execute("SELECT id, date FROM snapshots ORDER BY id DESC LIMIT 1").fetchone()
+            if not latest:
+                raise LookupError("No exchange rates stored yet.")
+            latest_id, latest_date = latest
+            previous = self.conn.execute(
+                "SELECT id FROM snapshots WHERE date < ? ORDER BY date DESC, timestamp DESC LIMIT 1",
+                (latest_date,),
+            ).fetchone()
+            latest_rates = self._snapshot_rates(latest_id)
+            if previous:
+                previous_rates = self._snapshot_rates(previous[0])
+            else:
+                # The previous day may already have been downsampled
+                previous_rollup = self.conn.execute(
+                    "SELECT period, date FROM rollups WHERE date < ? ORDER BY date DESC LIMIT 1", (latest_date,)
+                ).fetchone()
+                previous_rates = self._load_rollup(*previous_rollup)["rates"] if previous_rollup else None
+            latest_ohlc = self._day_ohlc(latest_date, latest_rates)
+        return latest_date, latest_rates, previous_rates, latest_ohlc
+
+    def _day_ohlc(self, date, close_rates):
+        """Return per-currency open/high/low/close for a day, in the shape of merge_snapshot's rollups."""
+        first_id = self.conn.execute(
+            "SELECT id FROM snapshots WHERE date = ? ORDER BY timestamp LIMIT 1", (date,)
+        ).fetchone()[0]
+        open_rates = self._snapshot_rates(first_id)
+        rows = self.conn.execute("""
+            SELECT currency, MIN(buying), MAX(buying), MIN(selling), MAX(selling)
+            FROM rates JOIN snapshots ON snapshots.id = rates.snapshot_id
+            WHERE snapshots.date = ?
+            GROUP BY currency
+        """, (date,))
+        ohlc = {}
+        for currency, buying_low, buying_high, selling_low, selling_high in rows:
+            lows_highs = {"buyingRate": (buying_low, buying_high), "sellingRate": (selling_low, selling_high)}
+            ohlc[currency] = {
+                field: {
+                    "open": open_rates.get(currency, close_rates.get(currency, {})).get(field),
+                    "high": high,
+                    "low": low,
+                    "close": close_rates.get(currency, {}).get(field),
+                }
+                for field, (low, high) in lows_highs.items()
+                if low is not None
+            }
+        return ohlc
+
+    def currency_history(self, currency, dates):
+        """Return (date, buying rate or None) for the latest snapshot, or the rollup close, of each date."""
+        with self._lock:
+            latest_ids = dict(self.conn.execute(
+                f"SELECT date, MAX(id) FROM snapshots WHERE date IN ({','.join('?' * len(dates))}) GROUP BY date",
+                dates,
+            ))
+            rates = dict(self.conn.execute(
+                f"SELECT snapshot_id, buying FROM rates WHERE currency = ? "
+                f"AND snapshot_id IN ({','.join('?' * len(latest_ids))})",
+                (currency, *latest_ids.values()),
+            ))
+            history = {date: rates.get(snapshot_id) for date, snapshot_id in latest_ids.items()}
+            rolled_up = [date for date in dates if date not in latest_ids]
+            if rolled_up:
+                history.update(self.conn.execute(
+                    f"SELECT date, buying_close FROM rollups WHERE currency = ? "
+                    f"AND date IN ({','.join('?' * len(rolled_up))})",
+                    (currency, *rolled_up),
+                ))
+        return [(date, history.get(date)) for date in dates]
+
+    def dates(self):
+        """Return the stored dates, newest first."""
+        with self._lock:
+            return [date for (date,) in self.conn.execute(
+                "SELECT date FROM snapshots UNION SELECT date FROM rollups ORDER BY date DESC"
+            )]
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self.conn.close()
+        logger.info("SQLite storage closed.")
+
+
+STORAGE_BACKENDS = {
+    "json": ExchangeRateStorage,
+    "log": ExchangeRateLogStorage,
+    "sqlite": SQLiteExchangeRateStorage,
+}
+
+
+def open_storage(backend="json", file_path=None, retention=None):
+    """Create the storage for the given backend name, using its default file unless one is given."""
+    storage_class = STORAGE_BACKENDS[backend]
+    if file_path:
+        return storage_class(file_path, retention=retention)
+    return storage_class(retention=retention)
+
+
+class RateArchive:
+    """Append-only columnar archive of snapshots, read through memory maps.
+
+    The directory holds ``timestamps.i8`` (int64 Unix seconds, one row per snapshot) and one
+    float64 column per currency and rate, e.g. ``USD.buyingRate.f8``, holding NaN where a
+    currency was missing. The timestamp column is appended last, so its length is the number
+    of committed rows and readers never see a half-written row. History queries binary-search
+    the timestamps and index the columns without parsing anything.
+    """
+
+    TIMESTAMPS = "timestamps.i8"
+
+    def __init__(self, directory="rates_archive"):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        # File name -> (mmap, memoryview) of the mapped prefix of the file
+        self._maps = {}
+
+    @staticmethod
+    def column_name(currency, field):
+        """Return the file name of a currency's column, keeping it safe as a path component."""
+        return f"{re.sub(r'[^A-Za-z0-9_-]', '_', currency)}.{field}.f8"
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def rows(self):
+        """Return the number of committed rows."""
+        try:
+            return os.path.getsize(self._path(self.TIMESTAMPS)) // 8
+        except FileNotFoundError:
+            return 0
+
+    def append(self, timestamp, rates):
+        """Append one snapshot as a row."""
+        rows = self.rows()
+        columns = {name for name in os.listdir(self.directory) if name.endswith(".f8")}
+        columns.update(self.column_name(currency, field) for currency in rates for field in RATE_FIELDS)
+        values = {
+            self.column_name(currency, field): currency_rates.get(field)
+            for currency, currency_rates in rates.items() for field in RATE_FIELDS
+        }
+
+        for name in columns:
+            value = values.get(name)
+            with open(self._path(name), 'ab') as file:
+                length = file.tell() // 8
+                if length > rows:
+                    # Left over from an interrupted append
+                    file.truncate(rows * 8)
+                    length = rows
+                # New currencies are back-filled with NaN up to the current row
+                padding = struct.pack('<d', math.nan) * (rows - length)
+                file.write(padding + struct.pack('<d', math.nan if value is None else float(value)))
+
+        with open(self._path(self.TIMESTAMPS), 'ab') as file:
+            file.write(struct.pack('<q', int(datetime.fromisoformat(timestamp).timestamp())))
+
+    def import_records(self, data):
+        """Append every snapshot of date-keyed storage records, oldest first."""
+        snapshots = {}
+        for record in data.values():
+            snapshots.update(record.get("snapshots") or {record["timestamp"]: record["rates"]})
+        for timestamp in sorted(snapshots):
+            self.append(timestamp, snapshots[timestamp])
+        logger.info(f"Imported {len(snapshots)} snapshots into {self.directory}.")
+
+    def _view(self, name, typecode, rows):
+        """Return a memoryview of the first rows of a column, remapping it if the file grew."""
+        mapped = self._maps.get(name)
+        if mapped is None or len(mapped[1]) < rows:
+            if mapped:
+                mapped[1].release()
+                mapped[0].close()
+            try:
+                with open(self._path(name), 'rb') as file:
+                    mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):
+                # Missing or empty column
+                self._maps.pop(name, None)
+                return None
+            mapped = self._maps[name] = (mm, memoryview(mm).cast(typecode))
+        return mapped[1][:rows]
+
+    def date_range(self):
+        """Return the ISO dates of the first and last rows, or None if the archive is empty."""
+        timestamps = self._view(self.TIMESTAMPS, 'q', self.rows())
+        if not timestamps:
+            return None
+        return tuple(datetime.fromtimestamp(timestamps[row]).date().isoformat() for row in (0, -1))
+
+    def history(self, currency, dates, field="buyingRate"):
+        """Return (date, rate or None) with the last rate recorded on each ISO date, or None if it has no row."""
+        rows = self.rows()
+        timestamps = self._view(self.TIMESTAMPS, 'q', rows)
+        column = self._view(self.column_name(currency, field), 'd', rows)
+        history = []
+        for date in dates:
+            rate = None
+            if timestamps and column:
+                start_of_day = datetime.fromisoformat(date)
+                end_of_day = start_of_day + timedelta(days=1)
+                row = bisect.bisect_left(timestamps, end_of_day.timestamp()) - 1
+                # A row from an earlier day means there was no snapshot on this one
+                if (0 <= row < len(column) and timestamps[row] >= start_of_day.timestamp()
+                        and not math.isnan(column[row])):
+                    rate = column[row]
+            history.append((date, rate))
+        return history
+
+    def close(self):
+        """Unmap all columns."""
+        for mm, view in self._maps.values():
+            view.release()
+            mm.close()
+        self._maps.clear()
+
+
+class AuthenticationError(Exception):
+    """Raised when the API rejects the Basic authorization credentials."""
+
+
+class CredentialCache:
+    """Persists the Basic authorization credentials extracted from the JavaScript file."""
+
+    def __init__(self, file_path="superrich_credentials.json", ttl=timedelta(days=7)):
+        self.file_path = file_path
+        self.ttl = ttl
+
+    def load(self, include_expired=False):
+        """Return the cached (username, password) or None if missing or expired."""
+        try:
+            with open(self.file_path, 'r') as file:
+                entry = json.load(file)
+            fetched_at = datetime.fromisoformat(entry["fetched_at"])
+        except FileNotFoundError:
+            logger.info("No cached credentials found.")
+            return None
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+            logger.warning("Credential cache is corrupted. Ignoring it.")
+            return None
+        if not entry.get("username") or not entry.get("password"):
+            logger.warning("Credential cache is incomplete. Ignoring it.")
+            return None
+
+        if not include_expired and datetime.now() - fetched_at > self.ttl:
+            logger.info("Cached credentials have expired.")
+            return None
+
+        logger.info(f"Using cached credentials (last verified: {entry.get('verified_at')}).")
+        return entry["username"], entry["password"]
+
+    def save(self, username, password, verified=False):
+        """Store freshly extracted credentials."""
+        now = datetime.now().isoformat()
+        self._write({
+            "username": username,
+            "password": password,
+            "fetched_at": now,
+            "verified_at": now if verified else None,
+        })
+        logger.info(f"Credentials cached in {self.file_path}.")
+
+    def mark_verified(self):
+        """Record that the cached credentials were accepted by the API."""
+        try:
+            with open(self.file_path, 'r') as file:
+                entry = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        entry["verified_at"] = datetime.now().isoformat()
+        self._write(entry)
+
+    def invalidate(self):
+        """Drop the cached credentials."""
+        try:
+            os.remove(self.file_path)
+            logger.info("Cached credentials invalidated.")
+        except FileNotFoundError:
+            pass
+
+    def _write(self, entry):
+        # Created as 0600 and renamed into place, so the secret is never readable by others or half-written
+        replace_file(self.file_path, lambda file: file.write(json.dumps(entry).encode('utf-8')), mode=0o600)
+
+
+class ValidatorCache:
+    """Persists HTTP cache validators (ETag, Last-Modified) per URL for conditional requests."""
+
+    def __init__(self, file_path="http_validators.json"):
+        self.file_path = file_path
+        try:
+            with open(self.file_path, 'r') as file:
+                self.validators = json.load(file)
+        except FileNotFoundError:
+            self.validators = {}
+        except json.JSONDecodeError:
+            logger.warning("Validator cache is corrupted. Starting with an empty cache.")
+            self.validators = {}
+
+    def conditional_headers(self, url):
+        """Return the If-None-Match/If-Modified-Since headers for the URL."""
+        entry = self.validators.get(url, {})
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    @staticmethod
+    def extract(response):
+        """Return the validators carried by the response, or None if it has none."""
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return None
+        return {"etag": etag, "last_modified": last_modified}
+
+    def save(self, url, validators):
+        """Remember the validators for the URL."""
+        if validators is None:
+            if self.validators.pop(url, None) is None:
+                return
+        else:
+            self.validators[url] = validators
+        with open(self.file_path, 'w') as file:
+            json.dump(self.validators, file)
+        logger.debug(f"Validators for {url} saved.")
 
 
 class SuperrichAPI:
-    def __init__(self, js_url, api_url):
+    def __init__(self, js_url, api_url, credential_cache=None, validator_cache=None, storage=None, archive=None,
+                 pool_size=2, connect_timeout=5, read_timeout=30):
         self.js_url = js_url
         self.api_url = api_url
+        self.storage = storage or ExchangeRateStorage()
+        self.archive = archive
         self.username = None
         self.password = None
         self.data = None
+        self.credential_cache = credential_cache or CredentialCache()
+        self.validator_cache = validator_cache or ValidatorCache()
+        # Validators are only persisted once the response they came with has been fully processed
+        self.pending_validators = {}
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = self.create_session(pool_size)
+
+    @staticmethod
+    def create_session(pool_size):
+        """Create a keep-alive HTTP session reused for every request."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            # Advertises brotli only when urllib3 is able to decode it
+            "Accept-Encoding": ACCEPT_ENCODING,
+            "Connection": "keep-alive",
+        })
+        return session
 
-    def fetch_js_file(self):
-        """Fetch the JavaScript file from the provided URL."""
+    def close(self):
+        """Close the pooled connections and the storage."""
+        self.session.close()
+        self.storage.close()
+        if self.archive:
+            self.archive.close()
+        logger.info("HTTP session closed.")
+
+    def fetch_js_file(self, conditional=False):
+        """Fetch the JavaScript file from the provided URL. Returns None if it has not changed."""
         logger.info("Fetching JavaScript file...")
-        response = requests.get(self.js_url)
+        headers = self.validator_cache.conditional_headers(self.js_url) if conditional else {}
+        response = self.session.get(self.js_url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            logger.info("JavaScript file not modified.")
+            return None
         if response.status_code != 200:
             logger.error(f"Failed to fetch JavaScript file. Status code: {response.status_code}")
             raise Exception(f"Failed to fetch JavaScript file. Status code: {response.status_code}")
         logger.info("JavaScript file fetched successfully.")
+        self.pending_validators[self.js_url] = ValidatorCache.extract(response)
         return response.text
 
     def extract_basic_auth(self, js_content):
@@ -115,21 +1118,31 @@ class SuperrichAPI:
         logger.info("Basic authorization string decoded successfully.")
 
     def make_api_request(self):
-        """Make an API request using the extracted Basic authorization."""
+        """Make an API request using the extracted Basic authorization. Returns False if the rates are unchanged."""
         if not self.username or not self.password:
             logger.error("Username and password are not set. Call `decode_basic_auth` first.")
             raise Exception("Username and password are not set. Call `decode_basic_auth` first.")
 
         auth = (self.username, self.password)
         headers = {
-            "Content-Type": "application/json"
+            "Content-Type": "application/json",
+            **self.validator_cache.conditional_headers(self.api_url),
         }
 
         logger.info("Making API request to fetch exchange rates...")
-        response = requests.get(self.api_url, auth=auth, headers=headers)
+        response = self.session.get(self.api_url, auth=auth, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            self.data = None
+            logger.info("Exchange rates not modified since the last request.")
+            return False
+        if response.status_code in (401, 403):
+            logger.warning(f"API rejected the credentials. Status code: {response.status_code}")
+            raise AuthenticationError(f"API rejected the credentials. Status code: {response.status_code}")
         if response.status_code == 200:
             self.data = response.json()
+            self.pending_validators[self.api_url] = ValidatorCache.extract(response)
             logger.info("API request successful. Exchange rates fetched.")
+            return True
         else:
             logger.error(f"API request failed. Status code: {response.status_code}\nResponse: {response.text}")
             raise Exception(f"API request failed. Status code: {response.status_code}\nResponse: {response.text}")
@@ -155,35 +1168,82 @@ class SuperrichAPI:
     def store_results(self, rates):
         """Store the results in a file."""
         logger.info("Storing results in file...")
-        storage = ExchangeRateStorage()
-        storage.update_or_add_record({
+        record = {
             "timestamp": datetime.now().isoformat(),  # Add a timestamp
             "rates": rates
-        })
-        logger.info("Results stored successfully.")
+        }
+        changed = self.storage.update_or_add_record(record)
+        if changed and self.archive:
+            self.archive.append(record["timestamp"], rates)
+        logger.info("Results stored successfully." if changed else "Rates unchanged; heartbeat updated.")
+
+    def refresh_credentials(self):
+        """Fetch the JavaScript file, extract and decode the credentials, and cache them.
+
+        Returns True if the credentials were freshly extracted from the JavaScript file.
+        """
+        # Only ask for an unchanged bundle when there are credentials to fall back on
+        js_content = self.fetch_js_file(conditional=bool(self.username and self.password))
+        if js_content is None:
+            logger.info("Keeping the current credentials.")
+        else:
+            encoded_auth = self.extract_basic_auth(js_content)
+            self.decode_basic_auth(encoded_auth)
+            self.commit_validators(self.js_url)
+        self.credential_cache.save(self.username, self.password)
+        return js_content is not None
+
+    def commit_validators(self, *urls):
+        """Persist the validators received for the given URLs."""
+        for url in urls:
+            if url in self.pending_validators:
+                self.validator_cache.save(url, self.pending_validators.pop(url))
 
     def run(self):
-        """Run the entire process: fetch JS, extract auth, decode, make API request, and store results."""
+        """Run the entire process: load or refresh credentials, make API request, and store results."""
         try:
             logger.info("Starting script...")
 
-            # Step 1: Fetch the JavaScript file
-            js_content = self.fetch_js_file()
+            # Step 1: Use cached credentials, scraping the JavaScript file only when none are available
+            cached = self.credential_cache.load()
+            fresh = False
+            if cached:
+                self.username, self.password = cached
+            else:
+                # Expired credentials are kept so an unchanged bundle can be revalidated instead of downloaded
+                self.username, self.password = self.credential_cache.load(include_expired=True) or (None, None)
+                fresh = self.refresh_credentials()
 
-            # Step 2: Extract the Basic authorization string
-            encoded_auth = self.extract_basic_auth(js_content)
-
-            # Step 3: Decode the Basic authorization string
-            self.decode_basic_auth(encoded_auth)
-
-            # Step 4: Make the API request
-            self.make_api_request()
+            # Step 2: Make the API request, re-scraping the credentials once if they are rejected.
+            # A 304 is only useful if the storage still has the rates it refers to, so an empty
+            # storage (new backend or reset file) asks for the full response.
+            stored_rates = self.storage.latest_stored_rates()
+            if stored_rates is None:
+                self.validator_cache.save(self.api_url, None)
+            try:
+                changed = self.make_api_request()
+            except AuthenticationError:
+                if fresh:
+                    raise
+                self.credential_cache.invalidate()
+                self.username = self.password = None
+                self.refresh_credentials()
+                changed = self.make_api_request()
+            self.credential_cache.mark_verified()
 
-            # Step 5: Extract rates for all currencies
-            rates = self.extract_all_rates()
+            if changed:
+                # Step 3: Extract rates for all currencies
+                rates = self.extract_all_rates()
+            elif stored_rates is None:
+                raise Exception("API answered 304 Not Modified, but no rates are stored.")
+            else:
+                # Still store the last rates: a new day gets its record, otherwise only the heartbeat is updated
+                logger.info("Exchange rates unchanged. Re-storing the last stored rates.")
+                rates = stored_rates
 
-            # Step 6: Store the results
+            # Step 4: Store the results
             self.store_results(rates)
+            self.commit_validators(self.api_url)
 
             logger.info("Script completed successfully.")
 
@@ -191,14 +1251,68 @@ class SuperrichAPI:
             logger.exception(f"Script failed with error: {e}")
 
 
-# Example usage
+def run_daemon(superrich_api, interval, jitter, stop_event):
+    """Run the scraper repeatedly until stop_event is set, sleeping interval ± jitter seconds between runs."""
+    logger.info(f"Starting daemon mode (interval: {interval}s, jitter: {jitter}s).")
+    while not stop_event.is_set():
+        superrich_api.run()
+        delay = max(0, interval + random.uniform(-jitter, jitter))
+        logger.info(f"Next run in {delay:.0f} seconds.")
+        stop_event.wait(delay)
+    logger.info("Daemon stopped.")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scrape Superrich exchange rates.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and scrape periodically instead of exiting after one run")
+    parser.add_argument("--interval", type=float, default=300,
+                        help="seconds between runs in daemon mode (default: 300)")
+    parser.add_argument("--jitter", type=float, default=30,
+                        help="maximum random deviation from the interval in seconds (default: 30)")
+    parser.add_argument("--storage", choices=sorted(STORAGE_BACKENDS), default="json",
+                        help="storage backend (default: json)")
+    parser.add_argument("--storage-file",
+                        help="storage file path (default: exchange_rates.json, .jsonl or .db)")
+    parser.add_argument("--raw-days", type=int, default=14,
+                        help="days to keep every snapshot before reducing them to daily OHLC (default: 14)")
+    parser.add_argument("--daily-days", type=int, default=365,
+                        help="days to keep daily OHLC before merging it into weekly OHLC (default: 365)")
+    parser.add_argument("--weekly-days", type=int,
+                        help="days to keep weekly OHLC (default: forever)")
+    parser.add_argument("--archive",
+                        help="also append snapshots to a memory-mapped columnar archive in this directory")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    configure_logging()
+
     # URLs
     js_url = "https://www.superrichthailand.com/app.min.js"
     api_url = "https://www.superrichthailand.com/api/v1/rates"
 
     # Create an instance of the SuperrichAPI class
-    superrich_api = SuperrichAPI(js_url, api_url)
+    retention = RetentionPolicy(args.raw_days, args.daily_days, args.weekly_days)
+    storage = open_storage(args.storage, args.storage_file, retention)
+    archive = None
+    if args.archive:
+        archive = RateArchive(args.archive)
+        if not archive.rows():
+            # Seed a new archive with the history already in the storage
+            archive.import_records(storage.load_data())
+    superrich_api = SuperrichAPI(js_url, api_url, storage=storage, archive=archive)
 
-    # Run the entire process
-    superrich_api.run()
+    try:
+        if args.daemon:
+            # Stop cleanly between runs on SIGTERM (e.g. docker stop) and SIGINT
+            stop_event = threading.Event()
+            signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+            signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+            run_daemon(superrich_api, args.interval, args.jitter, stop_event)
+        else:
+            # Run the entire process once
+            superrich_api.run()
+    finally:
+        superrich_api.close()